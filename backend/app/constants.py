@@ -11,10 +11,72 @@ DATABASE_NAME = "scouting-field"
 OBJECTIVE_RAW_COLLECTION = "objective_raw"
 SUBJECTIVE_RAW_COLLECTION = "subjective_raw"
 OBJECTIVE_RESULT_COLLECTION = "objective_result"
+OBJECTIVE_ACCUMULATOR_COLLECTION = "objective_accumulator"
+OBJECTIVE_FEATURE_COLLECTION = "objective_feature"
 SUBJECTIVE_RESULT_COLLECTION = "subjective_result"
 PIT_DATA_COLLECTION = "pit"
+LEASE_COLLECTION = "lease"
+GENERATION_COLLECTION = "generation"
+SYNC_STATE_COLLECTION = "sync_state"
+JOB_COLLECTION = "job"
+
+# Print the time spent per import and init step of every worker
+PROFILE_STARTUP = getenv("PROFILE_STARTUP", "0") == "1"
 
 # Utilities
 ALL_REEF_LEVELS = ["l1", "l2", "l3", "l4"]
+ALL_REEF_SIDES = ["AB", "CD", "EF", "GH", "IJ", "KL"]
 
 REMOTE_SERVERS = json.loads(getenv("REMOTE_SERVERS", '[]'))
+# Connection pool shared by every replication request of a worker
+REMOTE_LIMIT_PER_HOST = int(getenv("REMOTE_LIMIT_PER_HOST", "8"))
+REMOTE_KEEPALIVE_SECONDS = float(getenv("REMOTE_KEEPALIVE_SECONDS", "30"))
+REMOTE_CONCURRENCY = int(getenv("REMOTE_CONCURRENCY", "16"))
+REMOTE_TIMEOUT_SECONDS = float(getenv("REMOTE_TIMEOUT_SECONDS", "10"))
+
+# Replication outbox
+OUTBOX_LEASE = "outbox"
+OUTBOX_LEASE_SECONDS = float(getenv("OUTBOX_LEASE_SECONDS", "30"))
+OUTBOX_POLL_SECONDS = float(getenv("OUTBOX_POLL_SECONDS", "2"))
+OUTBOX_BATCH_SIZE = int(getenv("OUTBOX_BATCH_SIZE", "100"))
+OUTBOX_BACKOFF_BASE_SECONDS = float(getenv("OUTBOX_BACKOFF_BASE_SECONDS", "1"))
+OUTBOX_BACKOFF_MAX_SECONDS = float(getenv("OUTBOX_BACKOFF_MAX_SECONDS", "30"))
+# Times a remote may reject a record before the outbox stops sending it there
+OUTBOX_MAX_REJECTS = int(getenv("OUTBOX_MAX_REJECTS", "5"))
+
+# Number of documents the streaming fetch pulls from the cursor per round trip
+FETCH_BATCH_SIZE = int(getenv("FETCH_BATCH_SIZE", "200"))
+# Page size of the cursor-paginated listings
+DEFAULT_PAGE_LIMIT = int(getenv("DEFAULT_PAGE_LIMIT", "100"))
+MAX_PAGE_LIMIT = int(getenv("MAX_PAGE_LIMIT", "1000"))
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+# Pull sync: servers whose data is pulled into this one, e.g. the venue server for the cloud server
+SYNC_PEERS = json.loads(getenv("SYNC_PEERS", '[]'))
+SYNC_LEASE = "sync"
+SYNC_INTERVAL_SECONDS = float(getenv("SYNC_INTERVAL_SECONDS", "10"))
+SYNC_PAGE_SIZE = int(getenv("SYNC_PAGE_SIZE", "500"))
+# Every pull starts this far before the stored cursor, must exceed the insert latency plus the clock skew of the peer
+SYNC_OVERLAP_SECONDS = float(getenv("SYNC_OVERLAP_SECONDS", "60"))
+
+# Serialized objective results kept in memory by each worker
+RESULT_CACHE_SIZE = int(getenv("RESULT_CACHE_SIZE", "256"))
+
+# Refresh scheduler
+OBJECTIVE_REFRESH_LEASE = "objective_refresh"
+SUBJECTIVE_REFRESH_LEASE = "subjective_refresh"
+REFRESH_DEBOUNCE_SECONDS = float(getenv("REFRESH_DEBOUNCE_SECONDS", "2"))
+REFRESH_LEASE_SECONDS = float(getenv("REFRESH_LEASE_SECONDS", "60"))
+
+# Process pool of each worker that runs the CPU-bound stages of a refresh, 0 runs them on the event loop
+COMPUTE_WORKERS = int(getenv("COMPUTE_WORKERS", "1"))
+# Jobs submitted to the pool at once, more wait on the event loop without blocking it
+COMPUTE_QUEUE_DEPTH = int(getenv("COMPUTE_QUEUE_DEPTH", "8"))
+
+# Job queue consumed by the compute worker (python -m app.worker)
+# A claimed job is handed to another worker if it is not finished or extended within the visibility timeout
+JOB_VISIBILITY_SECONDS = float(getenv("JOB_VISIBILITY_SECONDS", "60"))
+JOB_MAX_ATTEMPTS = int(getenv("JOB_MAX_ATTEMPTS", "5"))
+JOB_POLL_SECONDS = float(getenv("JOB_POLL_SECONDS", "1"))
+JOB_BACKOFF_BASE_SECONDS = float(getenv("JOB_BACKOFF_BASE_SECONDS", "2"))
+JOB_BACKOFF_MAX_SECONDS = float(getenv("JOB_BACKOFF_MAX_SECONDS", "60"))
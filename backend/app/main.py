@@ -1,19 +1,32 @@
 from contextlib import asynccontextmanager
 from typing import Optional
 
-from fastapi import FastAPI
-from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from .startup import startup_step, print_startup_profile
 
-from .scripts.db import get_collection, init_db, disconnect_from_mongo
-from .constants import OBJECTIVE_RAW_COLLECTION
+with startup_step("import fastapi"):
+    from fastapi import FastAPI, Header, Response
+    from fastapi.middleware.cors import CORSMiddleware
+    from fastapi.responses import JSONResponse
+    from starlette import status
+    from typing_extensions import Annotated
 
-from .routers import objective_scout, subjective_scout, pit_scout, test
+with startup_step("import app.scripts"):
+    from .scripts.db import get_collection, init_db, disconnect_from_mongo
+    from .constants import OBJECTIVE_RAW_COLLECTION, NEXT_CURSOR_HEADER
+    from .scripts.scheduler import enqueue_full_obj_refresh, enqueue_sbj_refresh
+    from .scripts.generation import get_etag, is_not_modified
+
+with startup_step("import app.routers"):
+    from .routers import objective_scout, subjective_scout, pit_scout, test
 
 
 @asynccontextmanager
 async def lifespwn(app: FastAPI):
-    await init_db()
+    if await init_db():
+        # Results from before they were kept per event, rebuilt by the compute worker
+        await enqueue_full_obj_refresh()
+    # Recomputes, their compute pool, replication and pull sync run in the compute worker (app/worker.py)
+    print_startup_profile()
     yield
     await disconnect_from_mongo()
 
@@ -36,6 +49,7 @@ scouting_app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, "ETag"],
 )
 
 
@@ -65,7 +79,12 @@ scouting_app.include_router(test.router)
     description="Getting team list from the database.",
     response_description="Got team list successfully",
 )
-async def get_team_list(event_key: str = None):
+async def get_team_list(response: Response, event_key: str = None, if_none_match: Annotated[str | None, Header()] = None):
+    etag = await get_etag(event_key)
+    if is_not_modified(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+
     if event_key is None:
         team_list_raw = await get_collection(OBJECTIVE_RAW_COLLECTION).find({}, {"_id": 0, "team_number": 1}).to_list(None)
     else:
@@ -81,6 +100,7 @@ async def get_team_list(event_key: str = None):
 
 
 @scouting_app.get("/refresh_result")
-async def refresh_result():
-    await test.refresh_all_obj_results()
-    return {"message": "Result refreshed successfully"}
+async def refresh_result(event_key: str = None):
+    await enqueue_full_obj_refresh(event_key)
+    await enqueue_sbj_refresh(event_key)
+    return {"message": "Result refresh queued"}
@@ -299,9 +299,20 @@ class AutoResult(BaseModel):
     processor_score: GamePieceActionResult
     net_score: GamePieceActionResult
 
+class CycleTimeDistribution(BaseModel):
+    count: int
+    min: float
+    p25: float
+    median: float
+    p75: float
+    max: float
+
+class CycleTimeResult(GamePieceActionResult):
+    distribution: Optional[CycleTimeDistribution] = None
+
 class CycleTime(BaseModel):
-    algae: GamePieceActionResult
-    coral: GamePieceActionResult
+    algae: CycleTimeResult
+    coral: CycleTimeResult
 
 class TeleopResult(BaseModel):
     reef: ReefCountAbsoluteResultBySide
@@ -312,8 +323,18 @@ class TeleopResult(BaseModel):
 
 class ObjectiveResult (BaseModel):
     team_number: int
+    event_key: Optional[str] = None
     auto: AutoResult
     teleop: TeleopResult
     bypassed_count: int
     disabled_count: int
-    comment: List[str]
\ No newline at end of file
+    comment: List[str]
+
+class SubjectiveResult (BaseModel):
+    team_number: str
+    event_key: str
+    driver_awareness: GamePieceActionResult
+    coral_station_awareness: GamePieceActionResult
+    num_score_on_net: GamePieceActionResult
+    mobility: GamePieceActionResult
+    defense: GamePieceActionResult
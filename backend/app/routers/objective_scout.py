@@ -1,21 +1,31 @@
-from fastapi import APIRouter, HTTPException, Query, BackgroundTasks
+from fastapi import APIRouter, HTTPException, Query, Request, Header, Response
+from fastapi.responses import StreamingResponse
+from fastapi.exceptions import RequestValidationError
+from pydantic import TypeAdapter, ValidationError
 from starlette import status
 from typing_extensions import Annotated
-from pymongo.errors import DuplicateKeyError
+from pymongo import ASCENDING
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 from bson import ObjectId
 from datetime import datetime
 
 from ..scripts.db import get_collection
-from ..scripts.util import post_to_remote_server
+from ..scripts.util import stream_ndjson, wants_ndjson, find_page, find_next_cursor, page_query
 
-from ..constants import OBJECTIVE_RAW_COLLECTION, OBJECTIVE_RESULT_COLLECTION, REMOTE_SERVERS
+from ..constants import OBJECTIVE_RAW_COLLECTION, OBJECTIVE_RESULT_COLLECTION, FETCH_BATCH_SIZE, \
+    DEFAULT_PAGE_LIMIT, MAX_PAGE_LIMIT, NEXT_CURSOR_HEADER
 # , MatchRawDataFilterParams
 from ..model import ObjectiveMatchRawData, ObjectiveResult
-from ..scripts.objective_calculate import refresh_all_obj_results
+from ..scripts.scheduler import enqueue_obj_refresh, enqueue_obj_matches, process_obj_matches
+from ..scripts.generation import bump_generation, get_etag, get_generation, is_not_modified, make_etag
+from ..scripts.result_cache import get_cached_result, put_cached_result
+from ..scripts.outbox import get_pending_remotes
 
 # db[OBJECTIVE_DATA_COLLECTION]
 # db[OBJECTIVE_RESULT_COLLECTION]
 
+RawDataList = TypeAdapter(list[dict])
+
 router = APIRouter(
     prefix="/objective",
     tags=["Objective Match Data"]
@@ -29,44 +39,122 @@ router = APIRouter(
     response_description="Added a new objective match data successfully",
     status_code=status.HTTP_201_CREATED,
 )
-async def add_obj_match_data(data: ObjectiveMatchRawData, background_tasks: BackgroundTasks):
+async def add_obj_match_data(data: ObjectiveMatchRawData):
     try:
-        await get_collection(OBJECTIVE_RAW_COLLECTION).insert_one(data.model_dump(), bypass_document_validation=False, session=None)
+        await get_collection(OBJECTIVE_RAW_COLLECTION).insert_one({**data.model_dump(), "pending_remotes": get_pending_remotes()},
+                                                                  bypass_document_validation=False, session=None)
     except DuplicateKeyError:
+        # A retry of an insert whose refresh was never queued, the queue merges it if it was
+        await enqueue_obj_matches([data.model_dump(mode="json")])
         raise HTTPException(
             status_code=409, detail="Data with the same ulid already exists")
-    for remote_server in REMOTE_SERVERS:
-        background_tasks.add_task(post_to_remote_server, data.model_dump(
-        ), data.ulid, remote_server, "/objective/raw", OBJECTIVE_RAW_COLLECTION)
-    background_tasks.add_task(refresh_all_obj_results)
+    await process_obj_matches([data.model_dump(mode="json")])
     return {"message": "Data added successfully"}
 
 
+@router.post(
+    "/raw/batch",
+    name="Adding objective match data in batch",
+    description="Post a list of objective match data, as a JSON array or NDJSON, in the server database.",
+    response_description="Added the objective match data successfully",
+    status_code=status.HTTP_201_CREATED,
+)
+async def add_obj_match_data_batch(request: Request):
+    body = await request.body()
+    if request.headers.get("content-type", "").startswith("application/x-ndjson"):
+        body = b"[" + b",".join(line for line in body.splitlines() if line.strip()) + b"]"
+    try:
+        items = RawDataList.validate_json(body)
+    except ValidationError as e:
+        raise RequestValidationError(e.errors())
+
+    # Every item is validated on its own, so one bad record is reported instead of failing the whole batch
+    batch, results = [], []
+    for item in items:
+        try:
+            data = ObjectiveMatchRawData.model_validate(item)
+        except ValidationError as e:
+            errors = "; ".join(f"{'.'.join(str(loc) for loc in error['loc'])}: {error['msg']}" for error in e.errors())
+            results.append({"ulid": item.get("ulid"), "status": f"invalid: {errors}"})
+            continue
+        batch.append(data)
+        results.append({"ulid": data.ulid, "status": "created"})
+    valid_results = [result for result in results if result["status"] == "created"]
+
+    if batch:
+        try:
+            await get_collection(OBJECTIVE_RAW_COLLECTION).insert_many(
+                [{**data.model_dump(), "pending_remotes": get_pending_remotes()} for data in batch], ordered=False)
+        except BulkWriteError as e:
+            for error in e.details["writeErrors"]:
+                valid_results[error["index"]]["status"] = "duplicate" if error["code"] == 11000 else error["errmsg"]
+
+    inserted = [data for data, result in zip(batch, valid_results) if result["status"] == "created"]
+    await process_obj_matches([data.model_dump(mode="json") for data in inserted])
+    # Duplicates are only queued, in case a previous attempt failed before queuing them.
+    # The job queue coalesces the teams into one recompute per event
+    await enqueue_obj_matches([data.model_dump(mode="json") for data, result in zip(batch, valid_results)
+                               if result["status"] == "duplicate"])
+    return {"message": str(len(inserted)) + " of " + str(len(items)) + " data added successfully", "results": results}
+
+
 @router.get(
     "/raw",
     name="Getting objective match data",
-    description="Getting objective match data from the database.",
+    description="Getting a page of objective match data from the database. "
+                "Pass the cursor from the `X-Next-Cursor` header to get the next page, a page shorter than limit is the last one.",
     response_description="Got objective match data successfully",
     response_model=list[ObjectiveMatchRawData],
     status_code=status.HTTP_200_OK,
 )
-async def get_obj_match_data(data_query: Annotated[ObjectiveMatchRawData, Query()]):
-    return data_query
+async def get_obj_match_data(response: Response, event_key: str = None, team_number: str = None, cursor: str = None,
+                             limit: Annotated[int, Query(ge=1, le=MAX_PAGE_LIMIT)] = DEFAULT_PAGE_LIMIT):
+    query = {}
+    if event_key is not None:
+        query["event_key"] = event_key
+    if team_number is not None:
+        query["team_number"] = team_number
+    data, next_cursor = await find_page(OBJECTIVE_RAW_COLLECTION, query, cursor, limit)
+    if next_cursor is not None:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return data
 
 
 @router.get(
     "/fetch",
     name="Fetching objective match data",
-    description="Fetching objective match data from the database.",
+    description="Fetching objective match data from the database. Send `Accept: application/x-ndjson` to stream one document per line. "
+                "Pass the cursor from the `X-Next-Cursor` header to resume after the last document, a page shorter than limit is the last one. "
+                "A document inserted concurrently can commit behind a cursor already handed out, "
+                "so a repeated pull should resume from an older cursor and skip the ulids it already has.",
     response_description="Fetched objective match data successfully",
     response_model=list[ObjectiveMatchRawData],
     status_code=status.HTTP_200_OK,
 )
-async def fetch_obj_match_data(last_updated_timestamp: float = None):
-    if last_updated_timestamp is None:
-        data = await get_collection(OBJECTIVE_RAW_COLLECTION).find({}, {"_id": 0}).to_list(None)
+async def fetch_obj_match_data(response: Response, last_updated_timestamp: float = None, cursor: str = None,
+                               limit: Annotated[int | None, Query(ge=1, le=MAX_PAGE_LIMIT)] = None,
+                               accept: Annotated[str | None, Header()] = None,
+                               if_none_match: Annotated[str | None, Header()] = None):
+    etag = await get_etag(variant="-ndjson" if wants_ndjson(accept) else "")
+    if is_not_modified(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+
+    if last_updated_timestamp is None or cursor is not None:
+        query = {}
     else:
-        data = await get_collection(OBJECTIVE_RAW_COLLECTION).find({"_id": {"$gt": ObjectId.from_datetime(datetime.fromtimestamp(last_updated_timestamp))}}, {"_id": 0}).to_list(None)
+        query = {"_id": {"$gt": ObjectId.from_datetime(datetime.fromtimestamp(last_updated_timestamp))}}
+    if wants_ndjson(accept):
+        next_cursor = await find_next_cursor(OBJECTIVE_RAW_COLLECTION, query, cursor, limit)
+        find = get_collection(OBJECTIVE_RAW_COLLECTION).find(page_query(query, cursor), {"_id": 0, "uploaded_remote": 0, "pending_remotes": 0, "outbox_rejects": 0}) \
+            .sort("_id", ASCENDING)
+        if limit is not None:
+            find = find.limit(limit)
+        headers = {"ETag": etag} if next_cursor is None else {"ETag": etag, NEXT_CURSOR_HEADER: next_cursor}
+        return StreamingResponse(stream_ndjson(find.batch_size(FETCH_BATCH_SIZE)), media_type="application/x-ndjson", headers=headers)
+    data, next_cursor = await find_page(OBJECTIVE_RAW_COLLECTION, query, cursor, limit)
+    if next_cursor is not None:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
     return data
 
 
@@ -79,20 +167,54 @@ async def fetch_obj_match_data(last_updated_timestamp: float = None):
     status_code=status.HTTP_200_OK,
 )
 async def delete_obj_match_data(match_id: str):
-    await get_collection(OBJECTIVE_RAW_COLLECTION).delete_one({"match_id": match_id})
+    deleted = await get_collection(OBJECTIVE_RAW_COLLECTION).find_one_and_delete({"match_id": match_id}, {"_id": 0})
+    if deleted is not None:
+        await bump_generation(deleted["event_key"])
+        await enqueue_obj_refresh(deleted["event_key"], [deleted["team_number"]])
     return {"message": "Data with id [" + match_id + "] deleted successfully"}
 
 
 @router.get(
     "/result",
     name="Getting objective match results",
-    description="Getting objective match results from the database.",
+    description="Getting the objective match results of a team from the database, of its latest event if no event is given.",
     response_description="Got objective match results successfully",
     response_model=ObjectiveResult,
     status_code=status.HTTP_200_OK,
 )
-async def get_obj_match_results(team_number: str):
-    data = await get_collection(OBJECTIVE_RESULT_COLLECTION).find_one({"team_number": team_number}, {"_id": 0})
-    if data is None:
-        raise HTTPException(status_code=404, detail="Team not found")
+async def get_obj_match_results(team_number: str, event_key: str = None,
+                                if_none_match: Annotated[str | None, Header()] = None):
+    generation = await get_generation(event_key)
+    etag = make_etag(event_key, generation)
+    if is_not_modified(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+    payload = get_cached_result(team_number, event_key, generation)
+    if payload is None:
+        query = {"team_number": team_number}
+        if event_key is not None:
+            query["event_key"] = event_key
+        data = await get_collection(OBJECTIVE_RESULT_COLLECTION).find_one(query, {"_id": 0}, sort=[("_id", -1)])
+        if data is None:
+            raise HTTPException(status_code=404, detail="Team not found")
+        payload = ObjectiveResult.model_validate(data).model_dump_json().encode()
+        put_cached_result(team_number, event_key, generation, payload)
+    return Response(content=payload, media_type="application/json", headers={"ETag": etag})
+
+
+@router.get(
+    "/results",
+    name="Listing objective match results",
+    description="Getting a page of objective match results from the database. "
+                "Pass the cursor from the `X-Next-Cursor` header to get the next page, a page shorter than limit is the last one.",
+    response_description="Got objective match results successfully",
+    response_model=list[ObjectiveResult],
+    status_code=status.HTTP_200_OK,
+)
+async def list_obj_match_results(response: Response, event_key: str = None, cursor: str = None,
+                                 limit: Annotated[int, Query(ge=1, le=MAX_PAGE_LIMIT)] = DEFAULT_PAGE_LIMIT):
+    query = {} if event_key is None else {"event_key": event_key}
+    data, next_cursor = await find_page(OBJECTIVE_RESULT_COLLECTION, query, cursor, limit)
+    if next_cursor is not None:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
     return data
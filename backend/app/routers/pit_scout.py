@@ -1,11 +1,13 @@
-from fastapi import APIRouter, Body
+from fastapi import APIRouter, Body, HTTPException, Response
 from fastapi.params import Query
 from starlette import status
 from typing_extensions import Annotated
+from pymongo.errors import DuplicateKeyError
 
 from ..scripts.db import get_collection
+from ..scripts.util import find_page
 
-from ..constants import PIT_DATA_COLLECTION
+from ..constants import PIT_DATA_COLLECTION, DEFAULT_PAGE_LIMIT, MAX_PAGE_LIMIT, NEXT_CURSOR_HEADER
 from ..model import PitScoutData
 
 router = APIRouter(
@@ -23,7 +25,11 @@ router = APIRouter(
     status_code=status.HTTP_201_CREATED,
 )
 async def add_pit_scout_data(data: PitScoutData = Body(...)):
-    await get_collection(PIT_DATA_COLLECTION).insert_one(data.model_dump(), bypass_document_validation=False, session=None)
+    try:
+        await get_collection(PIT_DATA_COLLECTION).insert_one(data.model_dump(mode="json"), bypass_document_validation=False, session=None)
+    except DuplicateKeyError:
+        raise HTTPException(
+            status_code=409, detail="Data with the same ulid already exists")
     return data
 
 
@@ -37,3 +43,22 @@ async def add_pit_scout_data(data: PitScoutData = Body(...)):
 )
 async def get_pit_scout_data(data_query: Annotated[PitScoutData, Query()]):
     return data_query
+
+
+@router.get(
+    "/fetch",
+    name="Fetching pit scout data",
+    description="Fetching a page of pit scout data from the database. "
+                "Pass the cursor from the `X-Next-Cursor` header to resume after the last document, a page shorter than limit is the last one. "
+                "A document inserted concurrently can commit behind a cursor already handed out, "
+                "so a repeated pull should resume from an older cursor and skip the ulids it already has.",
+    response_description="Fetched pit scout data successfully",
+    response_model=list[PitScoutData],
+    status_code=status.HTTP_200_OK,
+)
+async def fetch_pit_scout_data(response: Response, cursor: str = None,
+                               limit: Annotated[int, Query(ge=1, le=MAX_PAGE_LIMIT)] = DEFAULT_PAGE_LIMIT):
+    data, next_cursor = await find_page(PIT_DATA_COLLECTION, {}, cursor, limit)
+    if next_cursor is not None:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return data
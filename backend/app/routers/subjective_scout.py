@@ -1,14 +1,15 @@
-from fastapi import APIRouter, BackgroundTasks
+from fastapi import APIRouter, HTTPException, Response
 from fastapi.params import Query
 from starlette import status
 from typing_extensions import Annotated
+from pymongo.errors import DuplicateKeyError
 
 from ..scripts.db import get_collection
+from ..scripts.util import find_page
 
-from ..constants import SUBJECTIVE_RAW_COLLECTION
-from ..model import SubjectiveMatchRawData  # , MatchRawDataFilterParams
-from ..scripts.objective_calculate import post_obj_results
-from ..scripts.subjective_calculate import post_sbj_results
+from ..constants import SUBJECTIVE_RAW_COLLECTION, SUBJECTIVE_RESULT_COLLECTION, DEFAULT_PAGE_LIMIT, MAX_PAGE_LIMIT, NEXT_CURSOR_HEADER
+from ..model import SubjectiveMatchRawData, SubjectiveResult  # , MatchRawDataFilterParams
+from ..scripts.scheduler import enqueue_sbj_refresh
 
 
 router = APIRouter(
@@ -22,12 +23,17 @@ router = APIRouter(
     name="Adding subjective match data",
     description="Post a new subjective match data in the server database.",
     response_description="Added a new subjective match data successfully",
-    response_model=SubjectiveMatchRawData,
     status_code=status.HTTP_201_CREATED,
 )
-async def add_sbj_match_data(data: SubjectiveMatchRawData, background_tasks: BackgroundTasks):
-    await get_collection(SUBJECTIVE_RAW_COLLECTION).insert_one(data.model_dump(), bypass_document_validation=False, session=None)
-    background_tasks.add_task(post_obj_results, data.team_number)
+async def add_sbj_match_data(data: SubjectiveMatchRawData):
+    try:
+        await get_collection(SUBJECTIVE_RAW_COLLECTION).insert_one(data.model_dump(mode="json"), bypass_document_validation=False, session=None)
+    except DuplicateKeyError:
+        await enqueue_sbj_refresh(data.event_key)
+        raise HTTPException(
+            status_code=409, detail="Data with the same ulid already exists")
+    # Only the results of this event change
+    await enqueue_sbj_refresh(data.event_key)
     return {"message": "Data added successfully"}
 
 
@@ -43,27 +49,52 @@ async def get_sbj_match_data(data_query: Annotated[SubjectiveMatchRawData, Query
     return data_query
 
 
+@router.get(
+    "/fetch",
+    name="Fetching subjective match data",
+    description="Fetching a page of subjective match data from the database. "
+                "Pass the cursor from the `X-Next-Cursor` header to resume after the last document, a page shorter than limit is the last one. "
+                "A document inserted concurrently can commit behind a cursor already handed out, "
+                "so a repeated pull should resume from an older cursor and skip the ulids it already has.",
+    response_description="Fetched subjective match data successfully",
+    response_model=list[SubjectiveMatchRawData],
+    status_code=status.HTTP_200_OK,
+)
+async def fetch_sbj_match_data(response: Response, cursor: str = None,
+                               limit: Annotated[int, Query(ge=1, le=MAX_PAGE_LIMIT)] = DEFAULT_PAGE_LIMIT):
+    data, next_cursor = await find_page(SUBJECTIVE_RAW_COLLECTION, {}, cursor, limit)
+    if next_cursor is not None:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return data
+
+
 @router.delete(
     "/raw/{match_id}",
     name="Deleting subjective match data",
     description="Deleting subjective match data from the database.",
     response_description="Deleted subjective match data successfully",
-    response_model=SubjectiveMatchRawData,
     status_code=status.HTTP_200_OK,
 )
 async def delete_sbj_match_data(match_id: str):
-    await get_collection(SUBJECTIVE_RAW_COLLECTION).delete_one({"match_id": match_id})
+    deleted = await get_collection(SUBJECTIVE_RAW_COLLECTION).find_one_and_delete({"match_id": match_id}, {"_id": 0})
+    if deleted is not None:
+        await enqueue_sbj_refresh(deleted["event_key"])
     return {"message": "Data with id [" + match_id + "] deleted successfully"}
 
 
 @router.get(
     "/result",
     name="Getting subjective match results",
-    description="Getting subjective match results from the database.",
+    description="Getting the subjective match results of a team from the database, of its latest event if no event is given.",
     response_description="Got subjective match results successfully",
-    response_model=list[SubjectiveMatchRawData],
+    response_model=SubjectiveResult,
     status_code=status.HTTP_200_OK,
 )
-async def get_sbj_match_results(team_number: int):
-    await post_sbj_results(team_number)
-    return await get_collection(SUBJECTIVE_RAW_COLLECTION).find()
+async def get_sbj_match_results(team_number: str, event_key: str = None):
+    query = {"team_number": team_number}
+    if event_key is not None:
+        query["event_key"] = event_key
+    data = await get_collection(SUBJECTIVE_RESULT_COLLECTION).find_one(query, {"_id": 0}, sort=[("_id", -1)])
+    if data is None:
+        raise HTTPException(status_code=404, detail="Team not found")
+    return data
@@ -1,7 +1,8 @@
 from fastapi import APIRouter
 
-from ..scripts.objective_calculate import count_hang_abs, post_obj_results, calc_reef_level_rel, \
-    refresh_all_obj_results
+from ..scripts.query_plans import check_query_plans
+from ..scripts.result_cache import get_result_cache_stats
+from ..scripts.scheduler import enqueue_full_obj_refresh
 
 router = APIRouter(
     prefix="/test"
@@ -12,4 +13,17 @@ reef_levels = ["l1", "l2", "l3", "l4"]
 
 @router.get("/")
 async def test():
-    return await refresh_all_obj_results()
+    # Run by the compute worker under the event leases, like /refresh_result
+    await enqueue_full_obj_refresh()
+    return {"message": "Result refresh queued"}
+
+
+@router.get("/query_plans")
+async def query_plans():
+    return await check_query_plans()
+
+
+@router.get("/result_cache")
+async def result_cache():
+    # Only the counters of the uvicorn worker that answers this request, see pid
+    return get_result_cache_stats()
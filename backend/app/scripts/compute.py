@@ -0,0 +1,55 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from ..constants import COMPUTE_WORKERS, COMPUTE_QUEUE_DEPTH
+
+"""
+[Compute pool]
+The NumPy and numba stages of a refresh run in a process pool, so a large refresh does not hold the event loop
+of the worker and ingest and reads keep being served meanwhile. Only plain data is sent to the pool,
+every database read and write stays on the event loop.
+"""
+
+compute_pool: ProcessPoolExecutor = None
+compute_semaphore = asyncio.Semaphore(COMPUTE_QUEUE_DEPTH)
+
+
+def init_compute_process():
+    from .kernels import warm_kernels
+
+    # Load the compiled kernels before the first job instead of during it
+    warm_kernels()
+
+
+def start_compute_pool():
+    global compute_pool
+    if COMPUTE_WORKERS <= 0 or compute_pool is not None:
+        return
+
+    # A forked child would inherit the MongoDB client threads and the event loop of the worker
+    compute_pool = ProcessPoolExecutor(
+        max_workers=COMPUTE_WORKERS,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_compute_process
+    )
+    print(f"Started compute pool with {COMPUTE_WORKERS} process(es)")
+
+
+def stop_compute_pool():
+    global compute_pool
+    if compute_pool is not None:
+        compute_pool.shutdown(cancel_futures=True)
+        compute_pool = None
+
+
+async def run_compute(func, *args):
+    """
+    Run func(*args) in the compute pool, func and its arguments must be picklable.
+    Without a pool (COMPUTE_WORKERS=0 or a script outside the app) it runs on the calling thread.
+    """
+    if compute_pool is None:
+        return func(*args)
+
+    async with compute_semaphore:
+        return await asyncio.get_running_loop().run_in_executor(compute_pool, func, *args)
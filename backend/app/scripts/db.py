@@ -1,13 +1,23 @@
-from pymongo import AsyncMongoClient
+import asyncio
+
+from pymongo import AsyncMongoClient, IndexModel, ASCENDING
 from ..constants import (MONGO_URL,
                          DATABASE_NAME,
                          OBJECTIVE_RAW_COLLECTION,
                          OBJECTIVE_RESULT_COLLECTION,
+                         OBJECTIVE_ACCUMULATOR_COLLECTION,
+                         OBJECTIVE_FEATURE_COLLECTION,
                          SUBJECTIVE_RAW_COLLECTION,
                          SUBJECTIVE_RESULT_COLLECTION,
-                         PIT_DATA_COLLECTION
+                         PIT_DATA_COLLECTION,
+                         LEASE_COLLECTION,
+                         GENERATION_COLLECTION,
+                         SYNC_STATE_COLLECTION,
+                         JOB_COLLECTION
                          )
 
+from ..startup import startup_step
+
 client: AsyncMongoClient = None
 db = None
 
@@ -31,25 +41,110 @@ async def check_collection_exist():
     existing_collections = await db.list_collection_names()
     required_collections = [OBJECTIVE_RAW_COLLECTION,
                             OBJECTIVE_RESULT_COLLECTION,
+                            OBJECTIVE_ACCUMULATOR_COLLECTION,
+                            OBJECTIVE_FEATURE_COLLECTION,
                             SUBJECTIVE_RAW_COLLECTION,
                             SUBJECTIVE_RESULT_COLLECTION,
-                            PIT_DATA_COLLECTION]
+                            PIT_DATA_COLLECTION,
+                            LEASE_COLLECTION,
+                            GENERATION_COLLECTION,
+                            SYNC_STATE_COLLECTION,
+                            JOB_COLLECTION]
+    missing_collections = [collection for collection in required_collections if collection not in existing_collections]
+    await asyncio.gather(*[db.create_collection(collection) for collection in missing_collections])
     for collection in required_collections:
-        if collection not in existing_collections:
-            await db.create_collection(collection)
+        if collection in missing_collections:
             print(f"Collection {collection} created.")
         else:
             print(f"Collection {collection} exists.")
 
 
+# Every index the hot queries need (see query_plans.py), create_indexes is a no-op for the ones that already exist
+INDEXES = {
+    OBJECTIVE_RAW_COLLECTION: [
+        IndexModel("ulid", unique=True),
+        IndexModel("match_id"),
+        IndexModel([("team_number", ASCENDING), ("event_key", ASCENDING)]),
+        IndexModel([("event_key", ASCENDING), ("team_number", ASCENDING)]),
+        # The outbox reads the records still pending for a remote in _id order
+        IndexModel([("pending_remotes", ASCENDING), ("_id", ASCENDING)]),
+    ],
+    OBJECTIVE_FEATURE_COLLECTION: [
+        IndexModel("ulid", unique=True),
+        IndexModel([("team_number", ASCENDING), ("event_key", ASCENDING)]),
+        # count_obj_matches groups the whole event, with or without a list of teams
+        IndexModel([("event_key", ASCENDING), ("team_number", ASCENDING)]),
+    ],
+    OBJECTIVE_ACCUMULATOR_COLLECTION: [
+        # Also keeps two concurrent upserts from creating a second accumulator
+        IndexModel([("team_number", ASCENDING), ("event_key", ASCENDING)], unique=True),
+    ],
+    OBJECTIVE_RESULT_COLLECTION: [
+        IndexModel([("team_number", ASCENDING), ("event_key", ASCENDING)], unique=True),
+        IndexModel("event_key"),
+    ],
+    SUBJECTIVE_RAW_COLLECTION: [
+        IndexModel("ulid", unique=True),
+        IndexModel("match_id"),
+        IndexModel("event_key"),
+    ],
+    SUBJECTIVE_RESULT_COLLECTION: [
+        # One result per team and event, see remove_legacy_documents
+        IndexModel([("team_number", ASCENDING), ("event_key", ASCENDING)], unique=True),
+        IndexModel("event_key"),
+    ],
+    PIT_DATA_COLLECTION: [
+        IndexModel("ulid", unique=True),
+    ],
+    JOB_COLLECTION: [
+        # At most one pending job per type and event, the one later submissions are merged into
+        IndexModel([("type", ASCENDING), ("event_key", ASCENDING)], unique=True,
+                   partialFilterExpression={"status": "pending"}),
+        IndexModel([("status", ASCENDING), ("available_at", ASCENDING)]),
+    ],
+}
+
+
+async def remove_legacy_documents():
+    """
+    Subjective results used to be inserted once per request, and objective results were kept per team
+    across every event. Both lack an event key, would break the unique (team, event) indexes,
+    and are derived data. Returns True if objective results were removed, so that they get rebuilt.
+    """
+    deleted = await db[SUBJECTIVE_RESULT_COLLECTION].delete_many({"event_key": {"$exists": False}})
+    if deleted.deleted_count:
+        print(f"Removed {deleted.deleted_count} legacy subjective results.")
+
+    deleted = await db[OBJECTIVE_RESULT_COLLECTION].delete_many({"event_key": {"$exists": False}})
+    if deleted.deleted_count:
+        print(f"Removed {deleted.deleted_count} legacy objective results.")
+
+    # Records without a team used to get a result too, which is not a valid ObjectiveResult
+    no_team = await db[OBJECTIVE_RESULT_COLLECTION].delete_many({"team_number": ""})
+    if no_team.deleted_count:
+        print(f"Removed {no_team.deleted_count} objective results without a team.")
+
+    return deleted.deleted_count > 0
+
+
 async def ckeck_and_create_index():
-    await db[OBJECTIVE_RAW_COLLECTION].create_index("ulid", unique=True)
+    # Index builds on MongoDB 4.2+ do not block reads and writes on the collection
+    created = await asyncio.gather(*[db[collection].create_indexes(indexes) for collection, indexes in INDEXES.items()])
+    for collection, names in zip(INDEXES, created):
+        print(f"Indexes of {collection}: {names}")
 
 
 async def init_db():
-    await connect_to_mongo()
-    await check_collection_exist()
-    await ckeck_and_create_index()
+    with startup_step("connect to MongoDB"):
+        await connect_to_mongo()
+    with startup_step("check collections"):
+        await check_collection_exist()
+    with startup_step("remove legacy documents"):
+        removed_legacy = await remove_legacy_documents()
+    with startup_step("create indexes"):
+        await ckeck_and_create_index()
+
+    return removed_legacy
 
 
 def get_db():
@@ -0,0 +1,39 @@
+from pymongo import UpdateOne
+
+from ..constants import GENERATION_COLLECTION
+from ..scripts.db import get_collection
+
+# Generation of the data of every event, bumped together with the one of the event that changed
+ALL_EVENTS = "*"
+
+
+async def bump_generation(event_key: str = None):
+    """
+    Mark the data of event_key as changed. Called on every raw insert and delete and after every result recompute.
+    """
+    keys = [ALL_EVENTS] if event_key is None else [ALL_EVENTS, event_key]
+    await get_collection(GENERATION_COLLECTION).bulk_write(
+        [UpdateOne({"_id": key}, {"$inc": {"generation": 1}}, upsert=True) for key in keys], ordered=False)
+
+
+async def get_generation(event_key: str = None):
+    generation = await get_collection(GENERATION_COLLECTION).find_one({"_id": ALL_EVENTS if event_key is None else event_key})
+    return 0 if generation is None else generation["generation"]
+
+
+def make_etag(event_key: str, generation: int, variant: str = ""):
+    return f'W/"{ALL_EVENTS if event_key is None else event_key}-{generation}{variant}"'
+
+
+async def get_etag(event_key: str = None, variant: str = ""):
+    """
+    ETag of a read endpoint over the data of event_key.
+    Read it before querying so that a change during the query leaves the client with an older tag, never a newer one.
+    """
+    return make_etag(event_key, await get_generation(event_key), variant)
+
+
+def is_not_modified(if_none_match: str, etag: str):
+    if if_none_match is None:
+        return False
+    return etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*"
@@ -0,0 +1,134 @@
+import asyncio
+import traceback
+from datetime import datetime, timedelta, timezone
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from ..constants import JOB_COLLECTION, JOB_VISIBILITY_SECONDS, JOB_MAX_ATTEMPTS, JOB_POLL_SECONDS, \
+    JOB_BACKOFF_BASE_SECONDS, JOB_BACKOFF_MAX_SECONDS
+from ..scripts.db import get_collection
+
+"""
+[Job queue]
+Recompute work is queued in the job collection by the request workers and run by the compute workers (app/worker.py).
+A job is pending until a worker claims it, and at most one job per type and event is pending, so a burst of
+submissions is coalesced into that job. A claimed job is running and invisible until its available_at passes:
+the worker extends it while the job runs, so it only becomes visible again when the worker crashed.
+A job that raised is retried the same way after a backoff, and is marked failed after JOB_MAX_ATTEMPTS claims.
+"""
+
+
+async def enqueue_job(job_type: str, event_key: str = None, teams: list[str] = None, delay: float = 0):
+    """
+    Queue a job, or merge teams into the pending job of the same type and event.
+    delay is only applied to a new job, it lets the rest of a burst join the job before it is claimed.
+    """
+    now = datetime.now(timezone.utc)
+    update = {
+        "$setOnInsert": {
+            "created_at": now,
+            "available_at": now + timedelta(seconds=delay),
+            "attempts": 0
+        },
+        "$addToSet": {"teams": {"$each": list(teams or [])}}
+    }
+    for _ in range(2):
+        try:
+            await get_collection(JOB_COLLECTION).update_one(
+                {"type": job_type, "event_key": event_key, "status": "pending"}, update, upsert=True)
+            return
+        except DuplicateKeyError:
+            # Another request inserted the pending job at the same time, merge into it
+            continue
+
+
+def get_due_jobs_query(now: datetime):
+    return {"status": {"$in": ["pending", "running"]}, "available_at": {"$lte": now}}
+
+
+async def claim_job(owner: str):
+    """
+    Take the oldest job that is due, either pending or running with an expired visibility timeout.
+    Returns None if there is none.
+    """
+    now = datetime.now(timezone.utc)
+    return await get_collection(JOB_COLLECTION).find_one_and_update(
+        get_due_jobs_query(now),
+        {
+            "$set": {
+                "status": "running",
+                "owner": owner,
+                "available_at": now + timedelta(seconds=JOB_VISIBILITY_SECONDS)
+            },
+            "$inc": {"attempts": 1}
+        },
+        sort=[("available_at", 1)],
+        return_document=ReturnDocument.AFTER
+    )
+
+
+async def extend_job(job: dict, owner: str):
+    await get_collection(JOB_COLLECTION).update_one(
+        {"_id": job["_id"], "owner": owner},
+        {"$set": {"available_at": datetime.now(timezone.utc) + timedelta(seconds=JOB_VISIBILITY_SECONDS)}}
+    )
+
+
+async def complete_job(job: dict, owner: str):
+    await get_collection(JOB_COLLECTION).delete_one({"_id": job["_id"], "owner": owner})
+
+
+async def fail_job(job: dict, owner: str, error: str):
+    if job["attempts"] >= JOB_MAX_ATTEMPTS:
+        update = {"status": "failed", "error": error, "failed_at": datetime.now(timezone.utc)}
+    else:
+        delay = min(JOB_BACKOFF_MAX_SECONDS, JOB_BACKOFF_BASE_SECONDS * 2 ** (job["attempts"] - 1))
+        update = {"error": error, "available_at": datetime.now(timezone.utc) + timedelta(seconds=delay)}
+
+    await get_collection(JOB_COLLECTION).update_one({"_id": job["_id"], "owner": owner}, {"$set": update})
+
+
+async def keep_job_visible(job: dict, owner: str):
+    while True:
+        await asyncio.sleep(JOB_VISIBILITY_SECONDS / 3)
+        await extend_job(job, owner)
+
+
+async def run_job(job: dict, owner: str, handlers: dict):
+    """
+    Run one claimed job with the handler of its type, handlers maps a job type to an async function of the job.
+    """
+    if job["attempts"] > JOB_MAX_ATTEMPTS:
+        # Claimed again after every attempt crashed its worker
+        await fail_job(job, owner, "Too many attempts")
+        return
+
+    keeper = asyncio.create_task(keep_job_visible(job, owner))
+    try:
+        await handlers[job["type"]](job)
+    except Exception as e:
+        print(f"Job {job['type']} of event {job['event_key']} failed with error: {e}")
+        await fail_job(job, owner, traceback.format_exc())
+        return
+    finally:
+        keeper.cancel()
+
+    await complete_job(job, owner)
+    print(f"Job {job['type']} of event {job['event_key']} done")
+
+
+async def run_jobs(owner: str, handlers: dict, stop: asyncio.Event):
+    while not stop.is_set():
+        try:
+            job = await claim_job(owner)
+            if job is not None:
+                await run_job(job, owner, handlers)
+                continue
+        except Exception as e:
+            print(f"Job queue failed with error: {e}")
+
+        try:
+            await asyncio.wait_for(stop.wait(), JOB_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
@@ -0,0 +1,79 @@
+import numba
+import numpy as np
+
+"""
+[Kernels]
+The numeric hot paths, compiled in nopython mode over float64 arrays.
+cache=True writes the machine code next to NUMBA_CACHE_DIR, which the Docker build fills by running this module,
+so a worker started from the image loads them instead of compiling on the first refresh.
+"""
+
+
+@numba.njit(cache=True)
+def mean_std(values):
+    """
+    Mean and population standard deviation of a 1D array, zeros for an empty one.
+    """
+    count = values.shape[0]
+    if count == 0:
+        return 0.0, 0.0
+
+    mean = 0.0
+    for i in range(count):
+        mean += values[i]
+    mean /= count
+
+    m2 = 0.0
+    for i in range(count):
+        m2 += (values[i] - mean) ** 2
+
+    return mean, np.sqrt(m2 / count)
+
+
+@numba.njit(cache=True)
+def rank_descending(values):
+    """
+    Rank the rows of every column of a 2D array, 1 is the highest value and ties keep the row order.
+    """
+    rows, columns = values.shape
+    ranks = np.empty((rows, columns), dtype=np.int64)
+    for j in range(columns):
+        order = np.argsort(-values[:, j], kind="mergesort")
+        for position in range(rows):
+            ranks[order[position], j] = position + 1
+
+    return ranks
+
+
+@numba.njit(cache=True)
+def z_scores(values):
+    """
+    Z-score of every cell of a 2D array within its column, 0 for a column without any spread.
+    """
+    rows, columns = values.shape
+    scores = np.zeros((rows, columns), dtype=np.float64)
+    for j in range(columns):
+        mean, std = mean_std(values[:, j])
+        if std == 0:
+            continue
+        for i in range(rows):
+            scores[i, j] = (values[i, j] - mean) / std
+
+    return scores
+
+
+def warm_kernels():
+    """
+    Compile (or load from the cache) every kernel with the signatures the app calls it with.
+    """
+    vector = np.zeros(2, dtype=np.float64)
+    matrix = np.zeros((2, 2), dtype=np.float64)
+    mean_std(vector)
+    mean_std(matrix[:, 0])
+    rank_descending(matrix)
+    z_scores(matrix)
+
+
+if __name__ == "__main__":
+    warm_kernels()
+    print(f"Kernels compiled into {numba.config.CACHE_DIR or 'the default cache'}")
@@ -1,49 +1,24 @@
 from enum import Enum
-from operator import itemgetter
 
-import numba
 import numpy as np
+from pymongo import ReplaceOne, UpdateOne
+from pymongo.errors import DuplicateKeyError
 
 from .util import get_all_teams
-from ..constants import OBJECTIVE_RAW_COLLECTION, OBJECTIVE_RESULT_COLLECTION, ALL_REEF_LEVELS
-from ..model import TeleopPathPoint
+from ..constants import OBJECTIVE_RAW_COLLECTION, OBJECTIVE_RESULT_COLLECTION, OBJECTIVE_ACCUMULATOR_COLLECTION, \
+    OBJECTIVE_FEATURE_COLLECTION, ALL_REEF_LEVELS, ALL_REEF_SIDES
+from ..model import AutoPathPoint, TeleopPathPoint
 from ..scripts.db import get_collection
+from ..scripts.compute import run_compute
 
 
-@numba.jit(cache=True)
-def get_abs_team_stats(data: list):
-    data_array = np.array(data)
+def calc_abs_team_stats(data: list):
+    # numba is only imported once a result is computed, not when a worker starts
+    from .kernels import mean_std
 
-    return {
-        "average": np.mean(data_array),
-        "stability": np.std(data_array)
-    }
-
-
-async def get_rel_team_stats(team_number: str, key: str, period: str):
-    # Query to find documents in get_collection(OBJECTIVE_RESULT_COLLECTION)
-    # print (f"${period}.{key}.average")
-    unsorted_data = await get_collection(OBJECTIVE_RESULT_COLLECTION).find(
-        {},  # Query criteria
-        {
-            "_id": 0,
-            "team_number": 1,
-            key: f"${period}.{key}.average"
-        }
-    ).to_list(None)
-    # print ({"unsorted_data": unsorted_data})
-
-    if not unsorted_data:  # Handle case where no data is returned by the query
-        # Default relative statistics when no data is found
-        return {"rank": None, "z_score": None}
-
-    # Sort only the valid data by the key
-    data = sorted(unsorted_data, key=itemgetter(key), reverse=True)
-
-    # print (data)
+    average, stability = mean_std(np.asarray(data, dtype=np.float64))
 
-    # Calculate the relative stats for the current team
-    return calc_relative(team_number, data, key)
+    return {"average": float(average), "stability": float(stability)}
 
 
 class ReefLevel(str, Enum):
@@ -62,283 +37,6 @@ class ReefSide(str, Enum):
     KL = "KL"
 
 
-async def count_preload(team_number: str):
-    raw_data = await get_collection(OBJECTIVE_RAW_COLLECTION).find(
-        {"team_number": team_number},
-        {
-            "_id": 0,
-            "preload": "$auto.preload"
-        }
-    ).to_list(None)
-    none = raw_data.count({"preload": "none"})
-    coral = raw_data.count({"preload": "coral"})
-    algae = raw_data.count({"preload": "algae"})
-    # print({"count_preload":{"none": none, "coral": coral, "algae": algae}})
-    return {"none": none, "coral": coral, "algae": algae}
-
-
-async def count_start_pos(team_number: str):
-    raw_data = await get_collection(OBJECTIVE_RAW_COLLECTION).find(
-        {"team_number": team_number},
-        {
-            "_id": 0,
-            "start_position": "$auto.start_position"
-        }
-    ).to_list(None)
-    left = raw_data.count({"start_position": "left"})
-    center = raw_data.count({"start_position": "center"})
-    right = raw_data.count({"start_position": "right"})
-    # print({"count_start_pos": {"left": left, "center": center, "right": right}})
-    return {"left": left, "center": center, "right": right}
-
-
-async def calc_leave_success_rate(team_number: str, is_percentage: int = 0):
-    raw_data = await get_collection(OBJECTIVE_RAW_COLLECTION).find(
-        {"team_number": team_number},
-        {"_id": 0,
-         "leave": "$auto.leave"}
-    ).to_list(None)
-    count_try = len(raw_data)
-    count_success = raw_data.count({"leave": True})
-
-    if count_try == 0:
-        return 0
-
-    # print({"calc_leave_success_rate": count_success / count_try})
-
-    match is_percentage:
-        case 1:
-            return count_success / count_try * 100
-        case _:
-            return count_success / count_try
-
-
-def convert_reef_level_to_pos(level: str):
-    match level:
-        case ReefLevel.L1.value:
-            return ["l1ReefAB", "l1ReefCD", "l1ReefEF", "l1ReefGH", "l1ReefIJ"]
-        case ReefLevel.L2.value:
-            return ["l2ReefAB", "l2ReefCD", "l2ReefEF", "l2ReefGH", "l2ReefIJ"]
-        case ReefLevel.L3.value:
-            return ["l3ReefAB", "l3ReefCD", "l3ReefEF", "l3ReefGH", "l3ReefIJ"]
-        case ReefLevel.L4.value:
-            return ["l4ReefAB", "l4ReefCD", "l4ReefEF", "l4ReefGH", "l4ReefIJ"]
-
-
-def convert_reef_level_side_to_pos(level: str, side: str):
-    match level:
-        case ReefLevel.L1.value:
-            match side:
-                case ReefSide.AB.value:
-                    return "l1ReefAB"
-                case ReefSide.CD.value:
-                    return "l1ReefCD"
-                case ReefSide.EF.value:
-                    return "l1ReefEF"
-                case ReefSide.GH.value:
-                    return "l1ReefGH"
-                case ReefSide.IJ.value:
-                    return "l1ReefIJ"
-                case ReefSide.KL.value:
-                    return "l1ReefKL"
-        case ReefLevel.L2.value:
-            match side:
-                case ReefSide.AB.value:
-                    return "l2ReefAB"
-                case ReefSide.CD.value:
-                    return "l2ReefCD"
-                case ReefSide.EF.value:
-                    return "l2ReefEF"
-                case ReefSide.GH.value:
-                    return "l2ReefGH"
-                case ReefSide.IJ.value:
-                    return "l2ReefIJ"
-                case ReefSide.KL.value:
-                    return "l2ReefKL"
-        case ReefLevel.L3.value:
-            match side:
-                case ReefSide.AB.value:
-                    return "l3ReefAB"
-                case ReefSide.CD.value:
-                    return "l3ReefCD"
-                case ReefSide.EF.value:
-                    return "l3ReefEF"
-                case ReefSide.GH.value:
-                    return "l3ReefGH"
-                case ReefSide.IJ.value:
-                    return "l3ReefIJ"
-                case ReefSide.KL.value:
-                    return "l3ReefKL"
-        case ReefLevel.L4.value:
-            match side:
-                case ReefSide.AB.value:
-                    return "l4ReefAB"
-                case ReefSide.CD.value:
-                    return "l4ReefCD"
-                case ReefSide.EF.value:
-                    return "l4ReefEF"
-                case ReefSide.GH.value:
-                    return "l4ReefGH"
-                case ReefSide.IJ.value:
-                    return "l4ReefIJ"
-                case ReefSide.KL.value:
-                    return "l4ReefKL"
-
-
-async def get_path(team_number: str, period: str = "auto"):
-    data = await get_collection(OBJECTIVE_RAW_COLLECTION).find(
-        {"team_number": team_number},
-        {
-            "_id": 0,
-            "path": "$" + period + ".path"
-        }
-    ).to_list(None)
-
-    # print({"get_path": data})
-    return data
-
-
-async def calc_auto_reef_level_abs(team_number: str, level: str):
-    converted_level = convert_reef_level_to_pos(level)
-    # print (converted_level)
-    matches = await get_path(team_number, "auto")
-
-    reef_matched = []
-    for paths in matches:
-        matched = 0
-        for single_path in paths["path"]:
-            if single_path.get("point") in converted_level:
-                matched += 1
-                # print ("got it")
-        reef_matched.append(matched)
-
-    # print (reef_matched)
-
-    # Handle edge case where reef_matched is empty
-    if not reef_matched:
-        reef_matched = [0]  # Assign a default value (e.g., no matches)
-
-    return get_abs_team_stats(reef_matched)
-
-
-def convert_teleop_reef_level_to_pos(level: str):
-
-    match level:
-        case ReefLevel.L1.value:
-            return "l1Reef"
-        case ReefLevel.L2.value:
-            return "l2Reef"
-        case ReefLevel.L3.value:
-            return "l3Reef"
-        case ReefLevel.L4.value:
-            return "l4Reef"
-
-
-async def calc_teleop_reef_level_abs(team_number: str, level: str):
-    converted_level = convert_teleop_reef_level_to_pos(level)
-    # print (converted_level)
-    matches = await get_path(team_number, "teleop")
-
-    # print({"teleop_test": converted_level})
-
-    reef_matched = []
-    for paths in matches:
-        matched = 0
-        for single_path in paths["path"]:
-            if single_path.get("point") == converted_level:
-                matched += 1
-                # print ("got it")
-        reef_matched.append(matched)
-
-    return get_abs_team_stats(reef_matched)
-
-
-def calc_relative(team_number: str, data: list, key: str):
-    # print ({"initialize_relative": data})
-
-    rank = 0
-
-    # Extract the values from data for key into a list
-    for item in data:
-        if item.get("team_number") == team_number:
-            rank = data.index(item) + 1
-        # Rank matches the 1-based index in sorted order
-    # Convert the list of values into a NumPy array
-    sorted_np = np.array([item.get(key) for item in data])
-
-    if rank == 0 or np.std(sorted_np) == 0:
-        return {"rank": rank, "z_score": 0.0}
-
-    # Calculate the z-score for the team's rank
-    z_score = float(
-        (sorted_np[rank - 1] - np.average(sorted_np)) / np.std(sorted_np))
-
-    if np.isnan(z_score):
-        z_score = 0.0
-
-    return {"rank": rank, "z_score": z_score}
-
-
-async def calc_reef_level_rel(team_number: str, level: str, period: str):
-    unsorted_data = await get_collection(OBJECTIVE_RESULT_COLLECTION).find(
-        {},  # Query criteria
-        {
-            "_id": 0,
-            "team_number": 1,
-            level: f"${period}.reef.{level}.average"
-        }
-    ).to_list(None)
-
-    # print ({"test_reef_level_rel":unsorted_data})
-
-    data = sorted(unsorted_data, key=itemgetter(level), reverse=True)
-
-    # print ({"calc_reef_level_rel": calc_reef_side_relative(team_number, data, level)})
-
-    return calc_relative(team_number, data, level)
-
-
-async def calc_auto_reef_score_abs(team_number: str):
-    scores = []
-
-    # Get paths for the given team and period
-    matches = await get_path(team_number, "auto")
-
-    for paths in matches:
-        score = 0
-        for single_path in paths["path"]:
-            for level in ALL_REEF_LEVELS:
-                d_score = get_reef_level_score_weight(level, "auto")
-                for pos in convert_reef_level_to_pos(level):
-                    if single_path.get("point") == pos:
-                        score += d_score
-                        break
-        scores.append(score)
-
-    # print (scores)
-    return get_abs_team_stats(scores)
-
-
-async def calc_auto_reef_score_rel(team_number: str):
-    return await get_rel_team_stats(team_number, "reef_score", "auto")
-
-
-def convert_auto_reef_side_to_pos(side: str):
-    match side:
-        case ReefSide.AB.value:
-            return ["l1ReefAB", "l2ReefAB", "l3ReefAB", "l4ReefAB"]
-        case ReefSide.CD.value:
-            return ["l1ReefCD", "l2ReefCD", "l3ReefCD", "l4ReefCD"]
-        case ReefSide.EF.value:
-            return ["l1ReefEF", "l2ReefEF", "l3ReefEF", "l4ReefEF"]
-        case ReefSide.GH.value:
-            return ["l1ReefGH", "l2ReefGH", "l3ReefGH", "l4ReefGH"]
-        case ReefSide.IJ.value:
-            return ["l1ReefIJ", "l2ReefIJ", "l3ReefIJ", "l4ReefIJ"]
-        case ReefSide.KL.value:
-            return ["l1ReefKL", "l2ReefKL", "l3ReefKL", "l4ReefKL"]
-
-
 def get_reef_level_score_weight(level: str, period: str):
     match period:
         case "auto":
@@ -363,389 +61,365 @@ def get_reef_level_score_weight(level: str, period: str):
                     return 5
 
 
-async def calc_auto_reef_score_by_side_abs(team_number: str, side: str):
-    converted_side = convert_auto_reef_side_to_pos(side)
-    # print(converted_side)
-    point_value = get_reef_level_score_weight(side, "auto")
-    # print (point_value)
-    matches = await get_path(team_number, "auto")  # Fetch paths
-
-    # Check if paths is empty
-    if not matches:
-        return 0  # Return default value when no paths are present
-
-    filtered_matches = []
-
-    for paths in matches:
-        side_matched = []
-        for single_path in paths["path"]:
-            for pos in converted_side:
-                if single_path.get("point") == pos:
-                    side_matched.append(paths)
-                    break
-        # print(side_matched)
-        filtered_matches.append(side_matched)
-
-    side_scores = []
-
-    for match in filtered_matches:
-        if not match:
-            side_scores.append(0)
-            continue
-
-        for paths in match:
-            score = 0
-            for single_path in paths["path"]:
-                for level in ALL_REEF_LEVELS:
-                    d_score = get_reef_level_score_weight(level, "auto")
-                    for pos in convert_reef_level_to_pos(level):
-                        if single_path.get("point") == pos:
-                            score += d_score
-                            break
-            side_scores.append(score)
-
-    # Compute stats if side_matched has values
-    return get_abs_team_stats(side_scores)
-
-
-async def calc_auto_reef_score_by_side_rel(team_number: str, side: str):
-    unsorted_data = await get_collection(OBJECTIVE_RESULT_COLLECTION).find(
-        {},  # Query criteria
-        {
-            "_id": 0,
-            "team_number": 1,
-            side: f"$auto.reef_score_by_side.{side}.average"
-        }
+PRELOADS = ["none", "coral", "algae"]
+START_POSITIONS = ["left", "center", "right"]
+
+MATCH_METRICS = [
+    *[f"auto.preload.{preload}" for preload in PRELOADS],
+    *[f"auto.start_position.{position}" for position in START_POSITIONS],
+    "auto.leave",
+    *[f"auto.reef.{level}" for level in ALL_REEF_LEVELS],
+    *[f"auto.reef_point.{level}.{side}" for level in ALL_REEF_LEVELS for side in ALL_REEF_SIDES],
+    *[f"auto.reef_attempt_by_side.{side}" for side in ALL_REEF_SIDES],
+    *[f"auto.reef_success_by_side.{side}" for side in ALL_REEF_SIDES],
+    *[f"auto.reef_score_by_side.{side}" for side in ALL_REEF_SIDES],
+    "auto.reef_score",
+    "auto.processor_score",
+    "auto.net_score",
+    *[f"teleop.reef.{level}" for level in ALL_REEF_LEVELS],
+    "teleop.processor_score",
+    "teleop.net_score",
+    "teleop.hang",
+    "bypassed",
+    "disabled"
+]
+
+
+async def get_team_matches(team_number: str, event_key: str):
+    data = await get_collection(OBJECTIVE_RAW_COLLECTION).find(
+        {"team_number": team_number, "event_key": event_key},
+        {"_id": 0, "uploaded_remote": 0, "pending_remotes": 0, "outbox_rejects": 0}
     ).to_list(None)
 
-    data = sorted(unsorted_data, key=itemgetter(side), reverse=True)
-
-    return calc_relative(team_number, data, side)
-
-
-async def calc_reef_success_rate_by_side(team_number: str, side: str, period: str = "auto"):
-    converted_side = convert_auto_reef_side_to_pos(side)
-    matches_paths = await get_path(team_number, period)
-
-    matched = 0
-    count_succeeded = 0
+    # print({"get_team_matches": data})
+    return data
 
-    for paths in matches_paths:
-        for single_path in paths["path"]:
-            for pos in converted_side:
-                if single_path.get("point") == pos:
-                    matched += 1
-                    if single_path.get("success"):
-                        count_succeeded += 1
-                    break
 
-    if matched == 0:  # Avoid division by zero
-        return 0.0
+async def get_team_features(team_number: str, event_key: str, projection: dict):
+    data = await get_collection(OBJECTIVE_FEATURE_COLLECTION).find(
+        {"team_number": team_number, "event_key": event_key},
+        {"_id": 0, **projection}
+    ).to_list(None)
 
-    rate = count_succeeded / matched
+    return data
 
-    return rate
 
+"""
+[Point codes]
+Path points are encoded as small integers so that a match can be counted with numpy instead of
+comparing strings point by point. The reef points come first, level-major, so the first 24 auto
+codes reshape straight into a (level x side) matrix, and the first 4 teleop codes are the levels.
+"""
 
-async def count_processor_score_abs(team_number: str, period: str):
-    match_paths = await get_path(team_number, period)
+AUTO_REEF_POINTS = [f"{level}Reef{side}" for level in ALL_REEF_LEVELS for side in ALL_REEF_SIDES]
+AUTO_POINT_CODES = {
+    point: code for code, point in enumerate(
+        AUTO_REEF_POINTS + [point.value for point in AutoPathPoint if point.value not in AUTO_REEF_POINTS])
+}
+AUTO_REEF_CODE_COUNT = len(AUTO_REEF_POINTS)
 
-    # Safety check in case get_path returns None or invalid data
-    if not match_paths:
-        return {
-            "abs_team_stats": {},  # Default empty stats if no paths are found
-            "rel_team_stats": await get_rel_team_stats(team_number, "processor", period)
-        }
+TELEOP_REEF_POINTS = [f"{level}Reef" for level in ALL_REEF_LEVELS]
+TELEOP_POINT_CODES = {
+    point: code for code, point in enumerate(
+        TELEOP_REEF_POINTS + [point.value for point in TeleopPathPoint if point.value not in TELEOP_REEF_POINTS])
+}
 
-    processor_score = []
+AUTO_REEF_WEIGHTS = np.array([get_reef_level_score_weight(level, "auto") for level in ALL_REEF_LEVELS])
 
-    for paths in match_paths:
-        score = 0
-        for single_path in paths["path"]:
-            if period == "auto" and single_path.get("point") == "processor" and single_path.get("success"):
-                score += 6
-            elif period == "teleop" and single_path.get("point") == "processor":
-                score += 6
-        processor_score.append(score)
 
-    # print (processor_score)
-    # Ensure processor_score is not empty before calculating stats
-    if not processor_score:
-        return {"average": 0, "stability": 0}
+def encode_path(path: list[dict], point_codes: dict):
+    codes = np.array([point_codes.get(single_path.get("point"), -1) for single_path in path], dtype=np.int64)
+    success = np.array([bool(single_path.get("success")) for single_path in path], dtype=np.bool_)
+    return codes, success
 
-    # print({"count_processor_score": {**abs_team_stats, **rel_team_stats}})
 
-    return get_abs_team_stats(processor_score)
+def calc_match_abs(match: dict):
+    """
+    Count a single match from its encoded auto and teleop path and return the value of every metric in MATCH_METRICS.
+    """
+    metrics = dict.fromkeys(MATCH_METRICS, 0)
+
+    auto = match["auto"]
+    if f"auto.preload.{auto.get('preload')}" in metrics:
+        metrics[f"auto.preload.{auto.get('preload')}"] = 1
+    if f"auto.start_position.{auto.get('start_position')}" in metrics:
+        metrics[f"auto.start_position.{auto.get('start_position')}"] = 1
+    metrics["auto.leave"] = int(auto.get("leave") is True)
+
+    codes, success = encode_path(auto["path"], AUTO_POINT_CODES)
+    is_reef = (codes >= 0) & (codes < AUTO_REEF_CODE_COUNT)
+    reef = np.bincount(codes[is_reef], minlength=AUTO_REEF_CODE_COUNT).reshape(len(ALL_REEF_LEVELS), len(ALL_REEF_SIDES))
+    reef_success = np.bincount(
+        codes[is_reef & success], minlength=AUTO_REEF_CODE_COUNT).reshape(len(ALL_REEF_LEVELS), len(ALL_REEF_SIDES))
+    reef_score_by_side = AUTO_REEF_WEIGHTS @ reef
+
+    for i, level in enumerate(ALL_REEF_LEVELS):
+        metrics[f"auto.reef.{level}"] = int(reef[i].sum())
+        for j, side in enumerate(ALL_REEF_SIDES):
+            metrics[f"auto.reef_point.{level}.{side}"] = int(reef_success[i, j])
+    for j, side in enumerate(ALL_REEF_SIDES):
+        metrics[f"auto.reef_attempt_by_side.{side}"] = int(reef[:, j].sum())
+        metrics[f"auto.reef_success_by_side.{side}"] = int(reef_success[:, j].sum())
+        metrics[f"auto.reef_score_by_side.{side}"] = int(reef_score_by_side[j])
+    metrics["auto.reef_score"] = int(reef_score_by_side.sum())
+    metrics["auto.processor_score"] = int(np.count_nonzero((codes == AUTO_POINT_CODES["processor"]) & success)) * 6
+    metrics["auto.net_score"] = int(np.count_nonzero((codes == AUTO_POINT_CODES["net"]) & success)) * 4
+
+    teleop = match["teleop"]
+    codes, _ = encode_path(teleop["path"], TELEOP_POINT_CODES)
+    teleop_count = np.bincount(codes[codes >= 0], minlength=len(TELEOP_POINT_CODES))
+    for i, level in enumerate(ALL_REEF_LEVELS):
+        metrics[f"teleop.reef.{level}"] = int(teleop_count[i])
+    metrics["teleop.processor_score"] = int(teleop_count[TELEOP_POINT_CODES["processor"]]) * 6
+    metrics["teleop.net_score"] = int(teleop_count[TELEOP_POINT_CODES["net"]]) * 4
+    metrics["teleop.hang"] = teleop.get("hang_time") or 0
+
+    metrics["bypassed"] = int(match.get("bypassed") is True)
+    metrics["disabled"] = int(match.get("disabled") is True)
+
+    return metrics
 
 
-async def calc_processor_score_rel(team_number: str, period: str):
-    return await get_rel_team_stats(team_number, "processor_score", period)
+"""
+[Accumulator]
+Each team has one document per event in OBJECTIVE_ACCUMULATOR_COLLECTION holding, for every metric in MATCH_METRICS,
+the count, mean and M2 (sum of squared differences from the mean) of the per match values.
+The refresh job holds the event lease, reads the accumulators of its teams and merges in the feature rows of
+new records, or takes out the rows of deleted ones, with the parallel form of Welford's update.
+The ulids already in an accumulator are kept in its applied list, and each write sets the statistics and the list
+together, filtered on the ulids it adds being absent and the ones it removes being present,
+so a retried job never applies a record twice. The full refresh rebuilds the accumulators from the feature rows.
+"""
 
 
-async def count_net_score_abs(team_number: str, period: str):
-    matches = await get_path(team_number, period)
+def get_accumulator_arrays(accumulator: dict):
+    items = [get_by_path(accumulator, metric) or {} for metric in MATCH_METRICS]
+    return (np.array([item.get("count", 0) for item in items], dtype=np.float64),
+            np.array([item.get("mean", 0) for item in items], dtype=np.float64),
+            np.array([item.get("m2", 0) for item in items], dtype=np.float64))
 
-    # Check if paths is empty or invalid:
-    if not matches:
-        # Return default stats if no paths are found
-        return {
-            "max": 0,
-            "min": 0,
-            "average": 0,
-            "count": 0,
-            # Add any other relevant default statistics here
-        }
 
-    net_score = []
-
-    for paths in matches:
-        score = 0
-        for path in paths["path"]:
-            # Default to False if no "success" key
-            match period:
-                case "auto":
-                    if path.get("point") == "net" and path.get("success"):
-                        score += 4
-                case "teleop":
-                    if path.get("point") == "net":
-                        score += 4
-        net_score.append(score)
-
-    # Ensure net_score is not empty before proceeding:
-    if not net_score:
-        return {
-            "max": 0,
-            "min": 0,
-            "average": 0,
-            "count": 0,
-            # Add any other relevant default statistics here
-        }
-
-    # Compute stats if net_score has data
-    return get_abs_team_stats(net_score)
+def calc_accumulator_update(accumulator: dict, added: list[dict], removed: list[dict]):
+    """
+    accumulator is the metrics of an accumulator document, added and removed the flattened metrics of feature rows.
+    Returns the metrics of the accumulator without removed and with added, in the format of calc_accumulator.
+    """
+    count, mean, m2 = get_accumulator_arrays(accumulator)
+
+    if removed:
+        values = np.array([[item[metric] for metric in MATCH_METRICS] for item in removed], dtype=np.float64)
+        count_b, mean_b = len(removed), np.mean(values, axis=0)
+        m2_b = np.sum((values - mean_b) ** 2, axis=0)
+        rest = count - count_b
+        safe_rest = np.maximum(rest, 1)
+        rest_mean = np.where(rest > 0, (count * mean - count_b * mean_b) / safe_rest, 0)
+        delta = mean_b - rest_mean
+        m2 = np.where(rest > 0, m2 - m2_b - delta ** 2 * rest * count_b / np.maximum(count, 1), 0)
+        # The values are whole counts and scores, so what is left of an M2 of zero is rounding error
+        m2[m2 < 1e-9] = 0
+        count, mean = np.maximum(rest, 0), rest_mean
+
+    if added:
+        values = np.array([[item[metric] for metric in MATCH_METRICS] for item in added], dtype=np.float64)
+        count_b, mean_b = len(added), np.mean(values, axis=0)
+        m2_b = np.sum((values - mean_b) ** 2, axis=0)
+        total = count + count_b
+        delta = mean_b - mean
+        mean = mean + delta * count_b / total
+        m2 = m2 + m2_b + delta ** 2 * count * count_b / total
+        count = total
+
+    return {f"metrics.{metric}": {"count": int(count[i]), "mean": float(mean[i]), "m2": float(m2[i])}
+            for i, metric in enumerate(MATCH_METRICS)}
+
+
+async def apply_obj_accumulators(event_key: str, team_numbers: list[str], raw_ulids: set[str]):
+    """
+    Add the feature rows of the raw records of teams that are not in their accumulator yet, and remove the rows
+    of the records that are gone. Only the rows that change are read. Must run after the rows of new records are
+    written and before the rows of deleted records are removed. A team whose accumulator was written before
+    the applied list existed, or lost a row it still holds, is rebuilt instead.
+    """
+    accumulators = {accumulator["team_number"]: accumulator for accumulator in
+                    await get_collection(OBJECTIVE_ACCUMULATOR_COLLECTION).find(
+                        {"event_key": event_key, "team_number": {"$in": list(team_numbers)}}, {"_id": 0}
+                    ).to_list(None)}
+    stale_teams = {team for team, accumulator in accumulators.items() if "applied" not in accumulator}
+    applied = {ulid for accumulator in accumulators.values() for ulid in accumulator.get("applied", [])}
+
+    changed = (raw_ulids - applied) | (applied - raw_ulids)
+    features = await get_collection(OBJECTIVE_FEATURE_COLLECTION).find(
+        {"ulid": {"$in": list(changed)}}, {"_id": 0, "ulid": 1, "team_number": 1, "metrics": 1}
+    ).to_list(None) if changed else []
+    found = {feature["ulid"] for feature in features}
+    stale_teams |= {team for team, accumulator in accumulators.items()
+                    if set(accumulator.get("applied", [])) - raw_ulids - found}
+
+    for team_number in set(feature["team_number"] for feature in features) - stale_teams:
+        accumulator = accumulators.get(team_number, {})
+        added = [feature for feature in features if feature["team_number"] == team_number and feature["ulid"] in raw_ulids]
+        removed = [feature for feature in features if feature["team_number"] == team_number and feature["ulid"] not in raw_ulids]
+        metrics = await run_compute(calc_accumulator_update, accumulator.get("metrics", {}),
+                                    [flatten_data(feature["metrics"]) for feature in added],
+                                    [flatten_data(feature["metrics"]) for feature in removed])
+        removed_ulids = {feature["ulid"] for feature in removed}
+        guard = {"$nin": [feature["ulid"] for feature in added]}
+        if removed_ulids:
+            guard["$all"] = list(removed_ulids)
+        try:
+            await get_collection(OBJECTIVE_ACCUMULATOR_COLLECTION).update_one(
+                {"team_number": team_number, "event_key": event_key, "applied": guard},
+                {"$set": {**metrics,
+                          "applied": [ulid for ulid in accumulator.get("applied", []) if ulid not in removed_ulids]
+                                     + [feature["ulid"] for feature in added]}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            # Already applied by an earlier attempt, the update missed its filter and the upsert hit the unique index
+            print(f"Accumulator of team {team_number} of event {event_key} was already updated")
+
+    for team_number in stale_teams:
+        await rebuild_obj_accumulator(team_number, event_key)
+    # A team whose last record was deleted
+    await get_collection(OBJECTIVE_ACCUMULATOR_COLLECTION).delete_many(
+        {"event_key": event_key, "team_number": {"$in": list(team_numbers)}, "applied": {"$size": 0}})
+
+
+def calc_accumulator(matches_abs: list[dict]):
+    values = np.array([[item[metric] for metric in MATCH_METRICS] for item in matches_abs], dtype=np.float64)
+    mean = np.mean(values, axis=0)
+    m2 = np.sum((values - mean) ** 2, axis=0)
+
+    metrics = {}
+    for i, metric in enumerate(MATCH_METRICS):
+        metrics[f"metrics.{metric}"] = {"count": len(matches_abs), "mean": float(mean[i]), "m2": float(m2[i])}
+    return metrics
+
+
+def calc_feature_accumulator(features: list[dict]):
+    return calc_accumulator([flatten_data(feature["metrics"]) for feature in features])
+
+
+async def rebuild_obj_accumulator(team_number: str, event_key: str):
+    """
+    Recompute a team's accumulator of an event from all its feature rows, only called under the event lease.
+    """
+    features = await get_team_features(team_number, event_key, {"ulid": 1, "metrics": 1})
+    if not features:
+        await get_collection(OBJECTIVE_ACCUMULATOR_COLLECTION).delete_one({"team_number": team_number, "event_key": event_key})
+        return
+
+    # Every metric and the applied list are set together, so they always describe the same rows
+    await get_collection(OBJECTIVE_ACCUMULATOR_COLLECTION).update_one(
+        {"team_number": team_number, "event_key": event_key},
+        {"$set": {**await run_compute(calc_feature_accumulator, features),
+                  "applied": [feature["ulid"] for feature in features]}},
+        upsert=True
+    )
+
+
+def get_by_path(data: dict, path: str):
+    for key in path.split("."):
+        if not isinstance(data, dict):
+            return None
+        data = data.get(key)
+    return data
 
 
-async def calc_net_score_rel(team_number: str, period: str):
-    return await get_rel_team_stats(team_number, "net_score", period)
+def get_accumulator_sum(accumulator: dict, metric: str):
+    # Only used on metrics counted per match, so the sum is a whole number
+    item = get_by_path(accumulator, metric) or {}
+    return round(item.get("mean", 0) * item.get("count", 0))
 
 
-async def calc_auto_reef_point_count(team_number: str, pos: str):
-    matches = await get_path(team_number, "auto")
+def get_accumulator_stats(accumulator: dict, metric: str):
+    item = get_by_path(accumulator, metric) or {}
+    count = item.get("count", 0)
+    if count <= 0:
+        return {"average": 0, "stability": 0}
 
-    matched_per_match = []
+    return {
+        "average": item["mean"],
+        "stability": float(np.sqrt(max(item["m2"], 0) / count))
+    }
 
-    for paths in matches:
-        count = 0
-        for single_path in paths["path"]:
-            if single_path.get("point") == pos and single_path.get("success"):
-                count += 1
 
-        matched_per_match.append(count)
+async def count_obj_matches(event_key: str, team_numbers: list[str] = None):
+    """
+    Count the per match flags and collect the comments of many teams of an event with one aggregation.
+    Returns team_number -> counts.
+    """
+    match = {"event_key": event_key}
+    if team_numbers is not None:
+        match["team_number"] = {"$in": list(team_numbers)}
+    pipeline = [{"$match": match}]
+    pipeline.append({
+        "$group": {
+            "_id": "$team_number",
+            "count": {"$sum": 1},
+            **{f"preload_{preload}": {"$sum": f"$metrics.auto.preload.{preload}"} for preload in PRELOADS},
+            **{f"start_position_{position}": {"$sum": f"$metrics.auto.start_position.{position}"}
+               for position in START_POSITIONS},
+            "leave": {"$sum": "$metrics.auto.leave"},
+            "bypassed": {"$sum": "$metrics.bypassed"},
+            "disabled": {"$sum": "$metrics.disabled"},
+            "comment": {"$push": "$comment"}
+        }
+    })
 
-    # print({f"calc_auto_reef_point_count_abs-{pos}": matched_per_match})
+    cursor = await get_collection(OBJECTIVE_FEATURE_COLLECTION).aggregate(pipeline)
+    return {item["_id"]: item for item in await cursor.to_list(None)}
 
-    if not matched_per_match:
-        return 0.0
 
-    matched_per_match_np = np.array(matched_per_match)
+def pack_auto_data_abs(accumulator: dict, counts: dict):
+    count_try = counts["count"]
 
-    return float(np.average(matched_per_match_np))
+    reef_count_per_point = {"type": "average"}
+    for level in ALL_REEF_LEVELS:
+        reef_count_per_point[level] = {
+            side: get_accumulator_stats(accumulator, f"auto.reef_point.{level}.{side}")["average"]
+            for side in ALL_REEF_SIDES
+        }
+        reef_count_per_point[level]["average"] = sum(
+            reef_count_per_point[level][side] for side in ALL_REEF_SIDES) / len(ALL_REEF_SIDES)
+    reef_count_per_point["average"] = {
+        side: sum(reef_count_per_point[level][side] for level in ALL_REEF_LEVELS) / len(ALL_REEF_LEVELS)
+        for side in ALL_REEF_SIDES
+    }
+    reef_count_per_point["average"]["average"] = sum(
+        reef_count_per_point["average"][side] for side in ALL_REEF_SIDES) / len(ALL_REEF_SIDES)
 
+    reef_success_rate_by_side = {}
+    for side in ALL_REEF_SIDES:
+        matched = get_accumulator_sum(accumulator, f"auto.reef_attempt_by_side.{side}")
+        count_succeeded = get_accumulator_sum(accumulator, f"auto.reef_success_by_side.{side}")
+        # Avoid division by zero
+        reef_success_rate_by_side[side] = count_succeeded / matched if matched else 0.0
 
-async def pack_auto_data_abs(team_number: str):
     data = {
-        "preload_count": await count_preload(team_number),
-        "start_position_count": await count_start_pos(team_number),
-        "leave_success_rate": await calc_leave_success_rate(team_number),
-        "reef": {
-            "l1": {** await calc_auto_reef_level_abs(team_number, ReefLevel.L1.value)},
-            "l2": {** await calc_auto_reef_level_abs(team_number, ReefLevel.L2.value)},
-            "l3": {** await calc_auto_reef_level_abs(team_number, ReefLevel.L3.value)},
-            "l4": {** await calc_auto_reef_level_abs(team_number, ReefLevel.L4.value)},
-
+        "preload_count": {
+            preload: counts[f"preload_{preload}"] for preload in PRELOADS
         },
-        "reef_count_per_point": {
-            "type": "average",
-            "l1": {
-                "AB": await calc_auto_reef_point_count(team_number, "l1ReefAB"),
-                "CD": await calc_auto_reef_point_count(team_number, "l1ReefCD"),
-                "EF": await calc_auto_reef_point_count(team_number, "l1ReefEF"),
-                "GH": await calc_auto_reef_point_count(team_number, "l1ReefGH"),
-                "IJ": await calc_auto_reef_point_count(team_number, "l1ReefIJ"),
-                "KL": await calc_auto_reef_point_count(team_number, "l1ReefKL"),
-                "average":
-                    (
-                    await calc_auto_reef_point_count(team_number, "l1ReefAB")
-                    + await calc_auto_reef_point_count(team_number, "l1ReefCD")
-                    + await calc_auto_reef_point_count(team_number, "l1ReefEF")
-                    + await calc_auto_reef_point_count(team_number, "l1ReefGH")
-                    + await calc_auto_reef_point_count(team_number, "l1ReefIJ")
-                    + await calc_auto_reef_point_count(team_number, "l1ReefKL")
-                ) / 6
-            },
-            "l2": {
-                "AB": await calc_auto_reef_point_count(team_number, "l2ReefAB"),
-                "CD": await calc_auto_reef_point_count(team_number, "l2ReefCD"),
-                "EF": await calc_auto_reef_point_count(team_number, "l2ReefEF"),
-                "GH": await calc_auto_reef_point_count(team_number, "l2ReefGH"),
-                "IJ": await calc_auto_reef_point_count(team_number, "l2ReefIJ"),
-                "KL": await calc_auto_reef_point_count(team_number, "l2ReefKL"),
-                "average":
-                    (
-                    await calc_auto_reef_point_count(team_number, "l2ReefAB")
-                    + await calc_auto_reef_point_count(team_number, "l2ReefCD")
-                    + await calc_auto_reef_point_count(team_number, "l2ReefEF")
-                    + await calc_auto_reef_point_count(team_number, "l2ReefGH")
-                    + await calc_auto_reef_point_count(team_number, "l2ReefIJ")
-                    + await calc_auto_reef_point_count(team_number, "l2ReefKL")
-                ) / 6
-            },
-            "l3": {
-                "AB": await calc_auto_reef_point_count(team_number, "l3ReefAB"),
-                "CD": await calc_auto_reef_point_count(team_number, "l3ReefCD"),
-                "EF": await calc_auto_reef_point_count(team_number, "l3ReefEF"),
-                "GH": await calc_auto_reef_point_count(team_number, "l3ReefGH"),
-                "IJ": await calc_auto_reef_point_count(team_number, "l3ReefIJ"),
-                "KL": await calc_auto_reef_point_count(team_number, "l3ReefKL"),
-                "average":
-                    (
-                    await calc_auto_reef_point_count(team_number, "l3ReefAB")
-                    + await calc_auto_reef_point_count(team_number, "l3ReefCD")
-                    + await calc_auto_reef_point_count(team_number, "l3ReefEF")
-                    + await calc_auto_reef_point_count(team_number, "l3ReefGH")
-                    + await calc_auto_reef_point_count(team_number, "l3ReefIJ")
-                    + await calc_auto_reef_point_count(team_number, "l3ReefKL")
-                ) / 6
-            },
-            "l4": {
-                "AB": await calc_auto_reef_point_count(team_number, "l4ReefAB"),
-                "CD": await calc_auto_reef_point_count(team_number, "l4ReefCD"),
-                "EF": await calc_auto_reef_point_count(team_number, "l4ReefEF"),
-                "GH": await calc_auto_reef_point_count(team_number, "l4ReefGH"),
-                "IJ": await calc_auto_reef_point_count(team_number, "l4ReefIJ"),
-                "KL": await calc_auto_reef_point_count(team_number, "l4ReefKL"),
-                "average":
-                    (
-                    await calc_auto_reef_point_count(team_number, "l4ReefAB")
-                    + await calc_auto_reef_point_count(team_number, "l4ReefCD")
-                    + await calc_auto_reef_point_count(team_number, "l4ReefEF")
-                    + await calc_auto_reef_point_count(team_number, "l4ReefGH")
-                    + await calc_auto_reef_point_count(team_number, "l4ReefIJ")
-                    + await calc_auto_reef_point_count(team_number, "l4ReefKL")
-                ) / 6
-            },
-            "average": {
-                "AB": (
-                    await calc_auto_reef_point_count(team_number, "l1ReefAB")
-                    + await calc_auto_reef_point_count(team_number, "l2ReefAB")
-                    + await calc_auto_reef_point_count(team_number, "l3ReefAB")
-                    + await calc_auto_reef_point_count(team_number, "l4ReefAB")
-                ) / 4,
-                "CD": (
-                    await calc_auto_reef_point_count(team_number, "l1ReefCD")
-                    + await calc_auto_reef_point_count(team_number, "l2ReefCD")
-                    + await calc_auto_reef_point_count(team_number, "l3ReefCD")
-                    + await calc_auto_reef_point_count(team_number, "l4ReefCD")
-                ) / 4,
-                "EF": (
-                    await calc_auto_reef_point_count(team_number, "l1ReefEF")
-                    + await calc_auto_reef_point_count(team_number, "l2ReefEF")
-                    + await calc_auto_reef_point_count(team_number, "l3ReefEF")
-                    + await calc_auto_reef_point_count(team_number, "l4ReefEF")
-                ) / 4,
-                "GH": (
-                    await calc_auto_reef_point_count(team_number, "l1ReefGH")
-                    + await calc_auto_reef_point_count(team_number, "l2ReefGH")
-                    + await calc_auto_reef_point_count(team_number, "l3ReefGH")
-                    + await calc_auto_reef_point_count(team_number, "l4ReefGH")
-                ) / 4,
-                "IJ": (
-                    await calc_auto_reef_point_count(team_number, "l1ReefIJ")
-                    + await calc_auto_reef_point_count(team_number, "l2ReefIJ")
-                    + await calc_auto_reef_point_count(team_number, "l3ReefIJ")
-                    + await calc_auto_reef_point_count(team_number, "l4ReefIJ")
-                ) / 4,
-                "KL": (
-                    await calc_auto_reef_point_count(team_number, "l1ReefKL")
-                    + await calc_auto_reef_point_count(team_number, "l2ReefKL")
-                    + await calc_auto_reef_point_count(team_number, "l3ReefKL")
-                    + await calc_auto_reef_point_count(team_number, "l4ReefKL")
-                ) / 4,
-                "average": (
-                    await calc_auto_reef_point_count(team_number, "l1ReefAB")
-                    + await calc_auto_reef_point_count(team_number, "l2ReefAB")
-                    + await calc_auto_reef_point_count(team_number, "l3ReefAB")
-                    + await calc_auto_reef_point_count(team_number, "l4ReefAB")
-                    + await calc_auto_reef_point_count(team_number, "l1ReefCD")
-                    + await calc_auto_reef_point_count(team_number, "l2ReefCD")
-                    + await calc_auto_reef_point_count(team_number, "l3ReefCD")
-                    + await calc_auto_reef_point_count(team_number, "l4ReefCD")
-                    + await calc_auto_reef_point_count(team_number, "l1ReefEF")
-                    + await calc_auto_reef_point_count(team_number, "l2ReefEF")
-                    + await calc_auto_reef_point_count(team_number, "l3ReefEF")
-                    + await calc_auto_reef_point_count(team_number, "l4ReefEF")
-                    + await calc_auto_reef_point_count(team_number, "l1ReefGH")
-                    + await calc_auto_reef_point_count(team_number, "l2ReefGH")
-                    + await calc_auto_reef_point_count(team_number, "l3ReefGH")
-                    + await calc_auto_reef_point_count(team_number, "l4ReefGH")
-                    + await calc_auto_reef_point_count(team_number, "l1ReefIJ")
-                    + await calc_auto_reef_point_count(team_number, "l2ReefIJ")
-                    + await calc_auto_reef_point_count(team_number, "l3ReefIJ")
-                    + await calc_auto_reef_point_count(team_number, "l4ReefIJ")
-                    + await calc_auto_reef_point_count(team_number, "l1ReefKL")
-                    + await calc_auto_reef_point_count(team_number, "l2ReefKL")
-                    + await calc_auto_reef_point_count(team_number, "l3ReefKL")
-                    + await calc_auto_reef_point_count(team_number, "l4ReefKL")
-                ) / 24
-            }
+        "start_position_count": {
+            position: counts[f"start_position_{position}"] for position in START_POSITIONS
         },
-        "reef_success_rate_by_side": {
-            "AB": await calc_reef_success_rate_by_side(team_number, ReefSide.AB.value, "auto"),
-            "CD": await calc_reef_success_rate_by_side(team_number, ReefSide.CD.value, "auto"),
-            "EF": await calc_reef_success_rate_by_side(team_number, ReefSide.EF.value, "auto"),
-            "GH": await calc_reef_success_rate_by_side(team_number, ReefSide.GH.value, "auto"),
-            "IJ": await calc_reef_success_rate_by_side(team_number, ReefSide.IJ.value, "auto"),
-            "KL": await calc_reef_success_rate_by_side(team_number, ReefSide.KL.value, "auto")
+        "leave_success_rate": counts["leave"] / count_try if count_try else 0,
+        "reef": {
+            level: get_accumulator_stats(accumulator, f"auto.reef.{level}") for level in ALL_REEF_LEVELS
         },
+        "reef_count_per_point": reef_count_per_point,
+        "reef_success_rate_by_side": reef_success_rate_by_side,
         "reef_score_by_side": {
-            "AB": {**await calc_auto_reef_score_by_side_abs(team_number, ReefSide.AB.value)},
-            "CD": {**await calc_auto_reef_score_by_side_abs(team_number, ReefSide.CD.value)},
-            "EF": {**await calc_auto_reef_score_by_side_abs(team_number, ReefSide.EF.value)},
-            "GH": {**await calc_auto_reef_score_by_side_abs(team_number, ReefSide.GH.value)},
-            "IJ": {**await calc_auto_reef_score_by_side_abs(team_number, ReefSide.IJ.value)},
-            "KL": {**await calc_auto_reef_score_by_side_abs(team_number, ReefSide.KL.value)}
+            side: get_accumulator_stats(accumulator, f"auto.reef_score_by_side.{side}") for side in ALL_REEF_SIDES
         },
-        "reef_score": {**await calc_auto_reef_score_abs(team_number)},
-        "processor_score": {**await count_processor_score_abs(team_number, "auto")},
-        "net_score": {**await count_net_score_abs(team_number, "auto")}
+        "reef_score": get_accumulator_stats(accumulator, "auto.reef_score"),
+        "processor_score": get_accumulator_stats(accumulator, "auto.processor_score"),
+        "net_score": get_accumulator_stats(accumulator, "auto.net_score")
     }
     # print({"pack_auto_data_abs": data})
     return data
 
 
-async def pack_auto_data_rel(team_number: str):
-    data = {
-        "reef": {
-            "l1": await calc_reef_level_rel(team_number, ReefLevel.L1.value, "auto"),
-            "l2": await calc_reef_level_rel(team_number, ReefLevel.L2.value, "auto"),
-            "l3": await calc_reef_level_rel(team_number, ReefLevel.L3.value, "auto"),
-            "l4": await calc_reef_level_rel(team_number, ReefLevel.L4.value, "auto")
-        },
-        "reef_score_by_side": {
-            "AB": await calc_auto_reef_score_by_side_rel(team_number, ReefSide.AB.value),
-            "CD": await calc_auto_reef_score_by_side_rel(team_number, ReefSide.CD.value),
-            "EF": await calc_auto_reef_score_by_side_rel(team_number, ReefSide.EF.value),
-            "GH": await calc_auto_reef_score_by_side_rel(team_number, ReefSide.GH.value),
-            "IJ": await calc_auto_reef_score_by_side_rel(team_number, ReefSide.IJ.value),
-            "KL": await calc_auto_reef_score_by_side_rel(team_number, ReefSide.KL.value)
-        },
-        "reef_score": await calc_auto_reef_score_rel(team_number),
-        "processor_score": await calc_processor_score_rel(team_number, "auto"),
-        "net_score": await calc_net_score_rel(team_number, "auto")
-    }
-    # print ({"pack_auto_data_rel": data})
-    return data
-
 """
 [Type of cycles]
 A. CORAL Cycle
@@ -757,250 +431,319 @@ B. ALGAE Cycle
     - REEF -> PROCESSOR
     - GROUND -> PROCESSOR
 
+A cycle ends at a scoring point and starts at the first pickup after the previous score of the same type,
+so every score is at most one cycle and pickups that never led to a score are not counted.
+Cycles are found within one match only, never from a pickup of one match to a score of the next.
 """
 
+CYCLE_TYPES = ["coral", "algae"]
+# Teleop point code -> index in CYCLE_TYPES of the cycle the point starts or ends, -1 if none
+CYCLE_STARTS = np.full(len(TELEOP_POINT_CODES), -1, dtype=np.int64)
+CYCLE_ENDS = np.full(len(TELEOP_POINT_CODES), -1, dtype=np.int64)
+for point in [TeleopPathPoint.GROUND_CORAL, TeleopPathPoint.CORAL_STATION]:
+    CYCLE_STARTS[TELEOP_POINT_CODES[point.value]] = CYCLE_TYPES.index("coral")
+for point in [TeleopPathPoint.L1_REEF, TeleopPathPoint.L2_REEF, TeleopPathPoint.L3_REEF, TeleopPathPoint.L4_REEF]:
+    CYCLE_ENDS[TELEOP_POINT_CODES[point.value]] = CYCLE_TYPES.index("coral")
+for point in [TeleopPathPoint.REEF_ALGAE, TeleopPathPoint.GROUND_ALGAE]:
+    CYCLE_STARTS[TELEOP_POINT_CODES[point.value]] = CYCLE_TYPES.index("algae")
+for point in [TeleopPathPoint.NET, TeleopPathPoint.PROCESSOR]:
+    CYCLE_ENDS[TELEOP_POINT_CODES[point.value]] = CYCLE_TYPES.index("algae")
+
+
+def calc_match_cycles(teleop: dict):
+    """
+    Cycle times of every type in one teleop path, encoded once and paired with np.searchsorted.
+    """
+    path = teleop["path"]
+    codes, _ = encode_path(path, TELEOP_POINT_CODES)
+    timestamps = np.array([single_path.get("timestamp") or 0 for single_path in path], dtype=np.float64)
+
+    order = np.argsort(timestamps, kind="stable")
+    codes, timestamps = codes[order], timestamps[order]
+    known = codes >= 0
+    start_types = np.where(known, CYCLE_STARTS[np.where(known, codes, 0)], -1)
+    end_types = np.where(known, CYCLE_ENDS[np.where(known, codes, 0)], -1)
+
+    cycles = {}
+    for cycle_type, name in enumerate(CYCLE_TYPES):
+        starts = timestamps[start_types == cycle_type]
+        ends = timestamps[end_types == cycle_type]
+        # First pickup strictly after the previous score of this type
+        previous_ends = np.concatenate(([-np.inf], ends[:-1]))
+        first_start = np.searchsorted(starts, previous_ends, side="right")
+        has_start = first_start < len(starts)
+        start_times = starts[np.minimum(first_start, len(starts) - 1)] if len(starts) else np.zeros(len(ends))
+        valid = has_start & (start_times < ends)
+        cycles[name] = (ends[valid] - start_times[valid]).tolist()
+
+    return cycles
+
+
+def calc_cycle_distribution(cycle_times: list):
+    if not cycle_times:
+        return {"count": 0, "min": 0.0, "p25": 0.0, "median": 0.0, "p75": 0.0, "max": 0.0}
 
-def search_cycle_time(data: list, cycle_type: str):
-    start_pos = []
-    end_pos = []
-
-    if cycle_type == "coral":
-        start_pos.extend([
-            TeleopPathPoint.GROUND_CORAL.value,
-            TeleopPathPoint.CORAL_STATION.value
-        ])
-        end_pos.extend([
-            TeleopPathPoint.L1_REEF.value,
-            TeleopPathPoint.L2_REEF.value,
-            TeleopPathPoint.L3_REEF.value,
-            TeleopPathPoint.L4_REEF.value
-        ])
-    elif cycle_type == "algae":
-        start_pos.extend([
-            TeleopPathPoint.REEF_ALGAE.value,
-            TeleopPathPoint.GROUND_ALGAE.value
-        ])
-        end_pos.extend([
-            TeleopPathPoint.NET.value,
-            TeleopPathPoint.PROCESSOR.value
-        ])
-
-    # print (start_pos, end_pos)
-    # Filter the data for start and end points
-    start_points = []
-    end_points = []
-
-    for match in data:
-        for point in match["path"]:
-            if point["point"] in start_pos:
-                start_points.append(point["timestamp"])
-            elif point["point"] in end_pos:
-                end_points.append(point["timestamp"])
-
-    cycle_time = []
-
-    i, j = 0, 0
-    n, m = len(start_points), len(end_points)
-
-    while i < n and j < m:
-        if start_points[i] < end_points[j]:
-            cycle_time.append(end_points[j] - start_points[i])
-            i += 1
-            j += 1
-        else:
-            j += 1
+    quantiles = np.quantile(np.asarray(cycle_times, dtype=np.float64), [0, 0.25, 0.5, 0.75, 1])
+    return {
+        "count": len(cycle_times),
+        **{name: float(value) for name, value in zip(["min", "p25", "median", "p75", "max"], quantiles)}
+    }
 
-    return cycle_time
 
+def calc_match_feature(match: dict):
+    """
+    The feature row of one raw record: every per match metric plus the cycle times of the match.
+    It is written once at ingest, so refreshing a team never parses the nested paths again.
+    """
+    metrics = {}
+    for metric, value in calc_match_abs(match).items():
+        *parents, key = metric.split(".")
+        item = metrics
+        for parent in parents:
+            item = item.setdefault(parent, {})
+        item[key] = value
 
-async def calc_cycle_time_abs(team_number: str, cycle_type: str):
-    data = await get_path(team_number, "teleop")
-    # print (data)
-    cycle_times = search_cycle_time(data, cycle_type)
+    return {
+        "ulid": match["ulid"],
+        "team_number": match["team_number"],
+        "event_key": match.get("event_key"),
+        "metrics": metrics,
+        "cycle_time": calc_match_cycles(match["teleop"]),
+        "comment": match.get("comment")
+    }
 
-    if not cycle_times:
-        # Handle empty cycle_times by returning default values
-        return {"average": 0, "stability": 0}
 
-    return get_abs_team_stats(cycle_times)
+def calc_match_features(matches: list[dict]):
+    return [calc_match_feature(match) for match in matches]
 
 
-async def calc_cycle_time_rel(team_number: str, cycle_type: str):
-    unsorted_data = await get_collection(OBJECTIVE_RESULT_COLLECTION).find(
-        {},  # Query criteria
-        {
-            "_id": 0,
-            "team_number": 1,
-            cycle_type: f"$teleop.cycle_time.{cycle_type}.average"
-        }
-    ).to_list(None)
+async def sync_obj_features(event_key: str, team_numbers: list[str]):
+    """
+    Bring the feature rows and accumulators of teams of the event in line with their raw records: the rows of
+    new records are computed, upserted by ulid and added to the accumulators, the rows of deleted records are
+    removed from the accumulators and then deleted. Every step is idempotent, so a job retried after a crash
+    ends in the same state.
+    """
+    query = {"event_key": event_key, "team_number": {"$in": list(team_numbers)}}
+    raw_ulids = {document["ulid"] for document in
+                 await get_collection(OBJECTIVE_RAW_COLLECTION).find(query, {"_id": 0, "ulid": 1}).to_list(None)}
+    feature_ulids = {document["ulid"] for document in
+                     await get_collection(OBJECTIVE_FEATURE_COLLECTION).find(query, {"_id": 0, "ulid": 1}).to_list(None)}
 
-    data = sorted(unsorted_data, key=itemgetter(cycle_type), reverse=True)
-    return calc_relative(team_number, data, cycle_type)
+    if raw_ulids - feature_ulids:
+        matches = await get_collection(OBJECTIVE_RAW_COLLECTION).find(
+            {"ulid": {"$in": list(raw_ulids - feature_ulids)}}, {"_id": 0, "uploaded_remote": 0, "pending_remotes": 0, "outbox_rejects": 0}
+        ).to_list(None)
+        features = await run_compute(calc_match_features, matches)
+        await get_collection(OBJECTIVE_FEATURE_COLLECTION).bulk_write(
+            [ReplaceOne({"ulid": feature["ulid"]}, feature, upsert=True) for feature in features], ordered=False)
+    await apply_obj_accumulators(event_key, team_numbers, raw_ulids)
+    if feature_ulids - raw_ulids:
+        await get_collection(OBJECTIVE_FEATURE_COLLECTION).delete_many({"ulid": {"$in": list(feature_ulids - raw_ulids)}})
 
 
-async def count_hang_abs(team_number):
-    data = await get_collection(OBJECTIVE_RAW_COLLECTION).find(
-        {"team_number": team_number},
-        {
-            "_id": 0,
-            "hang_time": "$teleop.hang_time"
-        }
-    ).to_list(None)
-    # print (data)
-    hang_time = [item.get("hang_time") for item in data]
-    # print  (hang_time)
-    # Handle empty hang_time case
-    if not hang_time:  # If hang_time is an empty list
-        return {"average": 0, "stability": 0}
+async def rebuild_obj_features(team_number: str, event_key: str):
+    matches = await get_team_matches(team_number, event_key)
 
-    # print({"calc_cycle_time": {**abs_stats, **rel_stats}})
-    return get_abs_team_stats(hang_time)
+    await get_collection(OBJECTIVE_FEATURE_COLLECTION).delete_many({"team_number": team_number, "event_key": event_key})
+    if matches:
+        await get_collection(OBJECTIVE_FEATURE_COLLECTION).insert_many(await run_compute(calc_match_features, matches))
 
 
-async def calc_hang_rel(team_number: str):
-    return await get_rel_team_stats(team_number, "hang", "teleop")
+def pack_cycle_time(cycle_times: list):
+    return {**calc_abs_team_stats(cycle_times), "distribution": calc_cycle_distribution(cycle_times)}
 
 
-async def pack_teleop_data_abs(team_number: str):
+def pack_teleop_data_abs(accumulator: dict, features: list[dict]):
     data = {
         "reef": {
-            "l1": {**await calc_teleop_reef_level_abs(team_number, ReefLevel.L1.value)},
-            "l2": {**await calc_teleop_reef_level_abs(team_number, ReefLevel.L2.value)},
-            "l3": {**await calc_teleop_reef_level_abs(team_number, ReefLevel.L3.value)},
-            "l4": {**await calc_teleop_reef_level_abs(team_number, ReefLevel.L4.value)},
-
+            level: get_accumulator_stats(accumulator, f"teleop.reef.{level}") for level in ALL_REEF_LEVELS
         },
-        "processor_score": {**await count_processor_score_abs(team_number, "teleop")},
-        "net_score": {**await count_net_score_abs(team_number, "teleop")},
+        "processor_score": get_accumulator_stats(accumulator, "teleop.processor_score"),
+        "net_score": get_accumulator_stats(accumulator, "teleop.net_score"),
         "cycle_time": {
-            "coral": {**await calc_cycle_time_abs(team_number, "coral")},
-            "algae": {**await calc_cycle_time_abs(team_number, "algae")}
+            cycle_type: pack_cycle_time(
+                [cycle_time for feature in features for cycle_time in feature["cycle_time"][cycle_type]])
+            for cycle_type in CYCLE_TYPES
         },
-        "hang": {**await count_hang_abs(team_number)}
+        "hang": get_accumulator_stats(accumulator, "teleop.hang")
     }
     # print({"pack_teleop_data": data})
     return data
 
 
-async def pack_teleop_data_rel(team_number: str):
+async def pack_obj_data_abs(team_number: str, event_key: str, counts: dict):
+    """
+    counts is the result of count_obj_matches for a batch of teams of the event including this one.
+    """
+    team_counts = counts.get(team_number)
+    accumulator = await get_collection(OBJECTIVE_ACCUMULATOR_COLLECTION).find_one(
+        {"team_number": team_number, "event_key": event_key}, {"_id": 0, "metrics": 1})
+    if team_counts is None or accumulator is None:
+        return None
+
+    # Only cycle times are still read per match
+    features = await get_team_features(team_number, event_key, {"cycle_time": 1})
+
+    return await run_compute(calc_obj_data_abs, team_number, event_key, accumulator["metrics"], team_counts, features)
+
+
+def calc_obj_data_abs(team_number: str, event_key: str, metrics: dict, team_counts: dict, features: list[dict]):
     data = {
-        "reef": {
-            "l1": {**await calc_reef_level_rel(team_number, ReefLevel.L1.value, "teleop")},
-            "l2": {**await calc_reef_level_rel(team_number, ReefLevel.L2.value, "teleop")},
-            "l3": {**await calc_reef_level_rel(team_number, ReefLevel.L3.value, "teleop")},
-            "l4": {**await calc_reef_level_rel(team_number, ReefLevel.L4.value, "teleop")}
-        },
-        "processor_score": {**await calc_processor_score_rel(team_number, "teleop")},
-        "net_score": {**await calc_net_score_rel(team_number, "teleop")},
-        "cycle_time": {
-            "coral": {**await calc_cycle_time_rel(team_number, "coral")},
-            "algae": {**await calc_cycle_time_rel(team_number, "algae")}
-        },
-        "hang": {**await calc_hang_rel(team_number)}
+        "team_number": team_number,
+        "event_key": event_key,
+        "auto": pack_auto_data_abs(metrics, team_counts),
+        "teleop": pack_teleop_data_abs(metrics, features),
+        "bypassed_count": team_counts["bypassed"],
+        "disabled_count": team_counts["disabled"],
+        "comment": team_counts["comment"]
     }
-    # print ({"pack_teleop_data_rel": data})
+    # print({"pack_data": data})
     return data
 
 
-async def get_comments(team_number: str):
-    # Get all documents matching the query and project only the 'comments' field
-    comments = await get_collection(OBJECTIVE_RAW_COLLECTION).find(
-        {"team_number": team_number},
-        {"_id": 0, "comment": 1}  # Fixed projection syntax
-    ).to_list(None)  # Convert the cursor to a list
+REL_METRICS = [
+    *[f"auto.reef.{level}" for level in ALL_REEF_LEVELS],
+    *[f"auto.reef_score_by_side.{side}" for side in ALL_REEF_SIDES],
+    "auto.reef_score",
+    "auto.processor_score",
+    "auto.net_score",
+    *[f"teleop.reef.{level}" for level in ALL_REEF_LEVELS],
+    "teleop.processor_score",
+    "teleop.net_score",
+    "teleop.cycle_time.coral",
+    "teleop.cycle_time.algae",
+    "teleop.hang"
+]
 
-    comments_raw = [item.get("comment") for item in comments]
 
-    return comments_raw  # Return the list of comments
+# Relative leaves of a result that has not been ranked yet
+UNRANKED_LEAVES = {
+    **{f"{metric}.rank": 0 for metric in REL_METRICS},
+    **{f"{metric}.z_score": 0.0 for metric in REL_METRICS}
+}
 
 
-async def count_bypassed(team_number: str):
-    raw_data = await get_collection(OBJECTIVE_RAW_COLLECTION).find(
-        {"team_number": team_number},
-        {
-            "_id": 0,
-            "bypassed": 1
-        }
-    ).to_list(None)
-    count = raw_data.count({"bypassed": True})
-    # print({"count_bypassed": count})
-    return count
+def get_metric_average(data: dict, metric: str):
+    return (get_by_path(data, metric) or {}).get("average")
 
 
-async def count_disabled(team_number: str):
-    raw_data = await get_collection(OBJECTIVE_RAW_COLLECTION).find(
-        {"team_number": team_number},
+def calc_relative(averages: np.ndarray):
+    """
+    Rank every team of an event on every metric at once, averages is a (teams x metrics) matrix.
+    Rank 1 is the highest average, ties keep the order the teams were read in.
+    """
+    from .kernels import rank_descending, z_scores
+
+    return rank_descending(averages), z_scores(averages)
+
+
+def calc_obj_ranks(results: list[dict]):
+    """
+    The rank and z-score leaves of every result, in the order of results.
+    """
+    averages = np.array(
+        [[get_metric_average(result, metric) for metric in REL_METRICS] for result in results],
+        dtype=np.float64
+    )
+    # Teams missing a metric are ranked as if they scored 0
+    averages = np.nan_to_num(averages)
+
+    ranks, scores = calc_relative(averages)
+
+    post_data = []
+    for i in range(len(results)):
+        item = {}
+        for j, metric in enumerate(REL_METRICS):
+            item[f"{metric}.rank"] = int(ranks[i, j])
+            item[f"{metric}.z_score"] = float(scores[i, j])
+        post_data.append(item)
+    return post_data
+
+
+async def rank_obj_results(event_key: str):
+    results = await get_collection(OBJECTIVE_RESULT_COLLECTION).find(
+        {"event_key": event_key},
         {
             "_id": 0,
-            "disabled": 1
+            "team_number": 1,
+            **{f"{metric}.average": 1 for metric in REL_METRICS}
         }
     ).to_list(None)
-    count = raw_data.count({"disabled": True})
-    # print({"count_disabled": count})
-    return count
 
+    if not results:
+        return {"message": "No result to rank"}
 
-async def pack_obj_data_abs(team_number: str):
-    data = {
-        "team_number": team_number,
-        "auto": await pack_auto_data_abs(team_number),
-        "teleop": await pack_teleop_data_abs(team_number),
-        "bypassed_count": await count_bypassed(team_number),
-        "disabled_count": await count_disabled(team_number),
-        "comment": await get_comments(team_number)
-    }
-    # print({"pack_data": data})
-    return data
+    requests = [
+        UpdateOne({"team_number": result["team_number"], "event_key": event_key}, {"$set": post_data})
+        for result, post_data in zip(results, await run_compute(calc_obj_ranks, results))
+    ]
 
+    await get_collection(OBJECTIVE_RESULT_COLLECTION).bulk_write(requests, ordered=False)
 
-async def pack_obj_data_rel(team_number: str):
-    data = {
-        "team_number": team_number,
-        "auto": await pack_auto_data_rel(team_number),
-        "teleop": await pack_teleop_data_rel(team_number),
-    }
-    # print({"pack_data": data})
-    return data
+    return {"message": "Data ranked successfully"}
 
 
-async def post_obj_results(team_number: str):
-    obj = {**await pack_obj_data_abs(team_number)}
-    rel = {**await pack_obj_data_rel(team_number)}
+async def post_obj_abs_results(team_number: str, event_key: str, counts: dict = None):
+    if counts is None:
+        counts = await count_obj_matches(event_key, [team_number])
 
-    post_data = merge_data(obj, rel)
+    data = await pack_obj_data_abs(team_number, event_key, counts)
+    if data is None:
+        if await get_collection(OBJECTIVE_RAW_COLLECTION).count_documents(
+                {"team_number": team_number, "event_key": event_key}, limit=1) == 0:
+            # The last match of this team in the event was deleted
+            await get_collection(OBJECTIVE_RESULT_COLLECTION).delete_one({"team_number": team_number, "event_key": event_key})
+            return
 
-    await get_collection(OBJECTIVE_RESULT_COLLECTION).update_one({"team_number": team_number}, {"$set": post_data}, upsert=True)
+        # Raw data from before the feature table existed
+        await rebuild_obj_features(team_number, event_key)
+        await rebuild_obj_accumulator(team_number, event_key)
+        data = await pack_obj_data_abs(team_number, event_key, await count_obj_matches(event_key, [team_number]))
 
-    return {"message": "Data posted successfully"}
+    post_data = flatten_data(data)
 
+    # Only the absolute leaves are set, so the ranks stay in place until rank_obj_results runs.
+    # A new result gets placeholder ranks, it is read as a valid ObjectiveResult before its first ranking
+    await get_collection(OBJECTIVE_RESULT_COLLECTION).update_one(
+        {"team_number": team_number, "event_key": event_key},
+        {"$set": post_data, "$setOnInsert": UNRANKED_LEAVES},
+        upsert=True
+    )
 
-async def refresh_all_obj_results():
-    team_set = await get_all_teams()
-    # print (team_set)
-    if '' in team_set:
-        team_set.remove('')
+
+async def refresh_event_obj_results(event_key: str):
+    """
+    Rebuild and rank the results of one event, the work only depends on the size of that event.
+    """
+    team_set = await get_all_teams(event_key)
 
     for team in team_set:
-        await post_obj_results(team)
+        await rebuild_obj_features(team, event_key)
+        await rebuild_obj_accumulator(team, event_key)
+
+    counts = await count_obj_matches(event_key)
+    for team in team_set:
+        await post_obj_abs_results(team, event_key, counts)
+
+    await rank_obj_results(event_key)
 
     return {"message": "Data refreshed successfully"}
 
 
-def merge_data(data1: dict, data2: dict):
+async def get_all_events():
+    return await get_collection(OBJECTIVE_RAW_COLLECTION).distinct("event_key")
+
+
+def flatten_data(data: dict, prefix: str = ""):
     """
-    合併兩個巢狀字典，對於相同的鍵，若值為字典則遞迴合併，否則使用 dict2 的值。
+    Turn a nested dict into MongoDB dotted paths, so that $set only replaces the given leaves.
     """
-    for key in data2:
-        if key in data1:
-            # 如果鍵存在且都是字典，則遞迴合併
-            if isinstance(data1[key], dict) and isinstance(data2[key], dict):
-                merge_data(data1[key], data2[key])
-            else:
-                # 否則使用 dict2 的值覆蓋 dict1 的值
-                data1[key] = data2[key]
+    flatten = {}
+    for key, value in data.items():
+        if isinstance(value, dict) and value:
+            flatten.update(flatten_data(value, f"{prefix}{key}."))
         else:
-            # 如果鍵不存在於 dict1，則直接添加
-            data1[key] = data2[key]
+            flatten[f"{prefix}{key}"] = value
 
-    return data1
+    return flatten
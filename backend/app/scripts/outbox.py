@@ -0,0 +1,197 @@
+import asyncio
+import hashlib
+import random
+import time
+from datetime import datetime, timezone
+
+from pymongo import UpdateOne
+
+from ..constants import REMOTE_SERVERS, OBJECTIVE_RAW_COLLECTION, SYNC_STATE_COLLECTION, OUTBOX_LEASE, \
+    OUTBOX_LEASE_SECONDS, OUTBOX_POLL_SECONDS, OUTBOX_BATCH_SIZE, OUTBOX_BACKOFF_BASE_SECONDS, \
+    OUTBOX_BACKOFF_MAX_SECONDS, OUTBOX_MAX_REJECTS
+from ..scripts.db import get_collection
+from ..scripts.scheduler import acquire_lease, release_lease
+from ..scripts.util import open_remote_session, remote_semaphore
+
+"""
+[Outbox]
+A record is inserted with every remote it still has to reach in its pending_remotes list, and a remote moves
+from there to uploaded_remote once it took the record, so the raw collection itself is the outbox and nothing is lost
+when a worker restarts. The outbox only reads the indexed pending_remotes, never the records that are done.
+One worker of the cluster holds the outbox lease and sends the pending records in batches,
+backing off exponentially (with jitter) from a remote that cannot be reached.
+A record the remote rejects is counted in its outbox_rejects and parked after OUTBOX_MAX_REJECTS attempts
+by pulling the remote from its pending_remotes, so it does not hold back the records behind it.
+Add the remote back to pending_remotes (and unset outbox_rejects) to send it again.
+"""
+
+# collection -> batch endpoint of the remote
+OUTBOX_ROUTES = {
+    OBJECTIVE_RAW_COLLECTION: "/objective/raw/batch",
+}
+
+# remote -> [consecutive failures, monotonic time before which it is not retried]
+remote_backoff: dict[str, list] = {}
+outbox_task: asyncio.Task = None
+
+
+def get_remote_key(remote_server: str):
+    # Field names cannot hold the dots of a URL
+    return hashlib.sha1(remote_server.encode()).hexdigest()[:16]
+
+
+def get_backoff_delay(failures: int):
+    delay = min(OUTBOX_BACKOFF_MAX_SECONDS, OUTBOX_BACKOFF_BASE_SECONDS * 2 ** (failures - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def get_pending_remotes(peer: str = None):
+    """
+    pending_remotes of a new record, every remote but the peer it was pulled from.
+    """
+    return [remote_server for remote_server in REMOTE_SERVERS if remote_server != peer]
+
+
+def get_outbox_query(remote_server: str):
+    """
+    Records remote_server does not have yet and has not rejected too often, sent in _id order.
+    """
+    return {"pending_remotes": remote_server}
+
+
+async def mark_pending_records(remote_server: str, collection_name: str):
+    """
+    Records inserted before remote_server was configured, or before pending_remotes existed, are not pending for it.
+    Mark the ones it does not have once per remote and collection, the marker is kept in sync_state.
+    """
+    state_id = f"outbox:{remote_server}:{collection_name}"
+    if await get_collection(SYNC_STATE_COLLECTION).find_one({"_id": state_id}) is not None:
+        return
+
+    marked = await get_collection(collection_name).update_many(
+        {
+            "uploaded_remote": {"$ne": remote_server},
+            f"outbox_rejects.{get_remote_key(remote_server)}.count": {"$not": {"$gte": OUTBOX_MAX_REJECTS}}
+        },
+        {"$addToSet": {"pending_remotes": remote_server}}
+    )
+    await get_collection(SYNC_STATE_COLLECTION).update_one(
+        {"_id": state_id}, {"$set": {"marked_at": datetime.now(timezone.utc)}}, upsert=True)
+    print(f"Marked {marked.modified_count} data of {collection_name} as pending for {remote_server}")
+
+
+async def post_outbox_batch(remote_url: str, batch: list[dict]):
+    """
+    Post batch and return the status of every record. A batch the remote refuses as a whole with a 4xx
+    is split in halves until the records it refuses are alone, and those are returned as rejected.
+    Raises if the remote could not be reached or failed.
+    """
+    import aiohttp
+
+    session = await open_remote_session()
+    async with remote_semaphore, session.post(remote_url, json=batch) as response:
+        if 400 <= response.status < 500 and response.status not in (408, 429):
+            error = f"{response.status}: {(await response.text())[:500]}"
+        elif response.status < 200 or response.status >= 300:
+            raise aiohttp.ClientResponseError(response.request_info, response.history, status=response.status,
+                                              message=await response.text())
+        else:
+            return (await response.json())["results"]
+
+    if len(batch) == 1:
+        return [{"ulid": batch[0]["ulid"], "status": error}]
+    half = len(batch) // 2
+    return await post_outbox_batch(remote_url, batch[:half]) + await post_outbox_batch(remote_url, batch[half:])
+
+
+async def send_outbox_batch(remote_server: str, collection_name: str, remote_path: str):
+    """
+    Send the oldest records of collection_name that remote_server does not have yet.
+    Returns the number of records the remote took. Raises if the remote could not take the batch.
+    """
+    rejects = f"outbox_rejects.{get_remote_key(remote_server)}"
+    batch = await get_collection(collection_name).find(
+        get_outbox_query(remote_server),
+        {"_id": 0, "uploaded_remote": 0, "pending_remotes": 0, "outbox_rejects": 0}
+    ).sort("_id", 1).limit(OUTBOX_BATCH_SIZE).to_list(None)
+    if not batch:
+        return 0
+
+    remote_url = f"{remote_server}{remote_path}"
+    results = await post_outbox_batch(remote_url, batch)
+
+    uploaded = [result["ulid"] for result in results if result["status"] in ("created", "duplicate")]
+    rejected = [result for result in results if result["status"] not in ("created", "duplicate")]
+    if uploaded:
+        await get_collection(collection_name).update_many(
+            {"ulid": {"$in": uploaded}},
+            {"$addToSet": {"uploaded_remote": remote_server}, "$pull": {"pending_remotes": remote_server}})
+    if rejected:
+        await get_collection(collection_name).bulk_write([
+            UpdateOne({"ulid": result["ulid"]},
+                      {"$inc": {f"{rejects}.count": 1},
+                       "$set": {f"{rejects}.remote": remote_server, f"{rejects}.error": result["status"]}})
+            for result in rejected
+        ], ordered=False)
+        await get_collection(collection_name).update_many(
+            {"ulid": {"$in": [result["ulid"] for result in rejected]}, f"{rejects}.count": {"$gte": OUTBOX_MAX_REJECTS}},
+            {"$pull": {"pending_remotes": remote_server}})
+        for result in rejected:
+            print(f"{remote_url} rejected data {result['ulid']}: {result['status']}")
+
+    print(f"Sent {len(uploaded)} data to {remote_url}")
+    return len(uploaded)
+
+
+async def flush_outbox():
+    """
+    Send one batch per remote and collection. Returns True if there may be more to send right away.
+    """
+    import aiohttp
+
+    more = False
+    for remote_server in REMOTE_SERVERS:
+        failures, retry_at = remote_backoff.get(remote_server, [0, 0])
+        if time.monotonic() < retry_at:
+            continue
+
+        try:
+            for collection_name, remote_path in OUTBOX_ROUTES.items():
+                await mark_pending_records(remote_server, collection_name)
+                if await send_outbox_batch(remote_server, collection_name, remote_path) == OUTBOX_BATCH_SIZE:
+                    more = True
+            remote_backoff.pop(remote_server, None)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            delay = get_backoff_delay(failures + 1)
+            remote_backoff[remote_server] = [failures + 1, time.monotonic() + delay]
+            print(f"Failed to replicate to {remote_server} with error: {e}, retrying in {delay:.1f}s")
+
+    return more
+
+
+async def run_outbox():
+    while True:
+        more = False
+        try:
+            if await acquire_lease(OUTBOX_LEASE, OUTBOX_LEASE_SECONDS):
+                more = await flush_outbox()
+        except Exception as e:
+            print(f"Outbox failed with error: {e}")
+
+        if not more:
+            # The records are inserted by the API workers, so new ones are only seen at the next poll
+            await asyncio.sleep(OUTBOX_POLL_SECONDS)
+
+
+def start_outbox():
+    global outbox_task
+    if REMOTE_SERVERS and (outbox_task is None or outbox_task.done()):
+        outbox_task = asyncio.create_task(run_outbox())
+
+
+async def stop_outbox():
+    global outbox_task
+    if outbox_task is not None:
+        outbox_task.cancel()
+        outbox_task = None
+        await release_lease(OUTBOX_LEASE)
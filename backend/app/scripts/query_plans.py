@@ -0,0 +1,126 @@
+from datetime import datetime, timezone
+
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING
+
+from ..constants import (OBJECTIVE_RAW_COLLECTION,
+                         OBJECTIVE_RESULT_COLLECTION,
+                         OBJECTIVE_ACCUMULATOR_COLLECTION,
+                         OBJECTIVE_FEATURE_COLLECTION,
+                         SUBJECTIVE_RAW_COLLECTION,
+                         SUBJECTIVE_RESULT_COLLECTION,
+                         PIT_DATA_COLLECTION,
+                         JOB_COLLECTION
+                         )
+from ..scripts.db import get_collection
+from ..scripts.jobs import get_due_jobs_query
+from ..scripts.outbox import get_outbox_query
+from ..scripts.util import encode_cursor, page_query
+
+"""
+[Query plans]
+The filter and sort of every query the app sends on a hot path, with sample values.
+The filters that are built by a function are built by the same function here, the others are written
+the way their caller writes them. Queries by _id alone (leases, generations, sync state) are left out.
+A plan without a COLLSCAN can still walk a whole index and filter every document it fetches,
+so the executed plan must also examine about as many keys and documents as it returns.
+"""
+
+# Keys or documents a plan may examine beyond the ones it returns, the end of an index range costs one
+PLAN_SLACK = 2
+
+
+def get_hot_queries():
+    cursor = encode_cursor(ObjectId())
+    teams = {"$in": [""]}
+    return [
+        # Ingest, delete and the feature sync
+        (OBJECTIVE_RAW_COLLECTION, {"ulid": ""}, None),
+        (OBJECTIVE_RAW_COLLECTION, {"ulid": {"$in": [""]}}, None),
+        (OBJECTIVE_RAW_COLLECTION, {"match_id": ""}, None),
+        (OBJECTIVE_RAW_COLLECTION, {"event_key": "", "team_number": teams}, None),
+        (OBJECTIVE_RAW_COLLECTION, {"team_number": "", "event_key": ""}, None),
+        # Team list, listings and fetch pages
+        (OBJECTIVE_RAW_COLLECTION, {"event_key": ""}, None),
+        (OBJECTIVE_RAW_COLLECTION, page_query({}, None), [("_id", ASCENDING)]),
+        (OBJECTIVE_RAW_COLLECTION, page_query({}, cursor), [("_id", ASCENDING)]),
+        (OBJECTIVE_RAW_COLLECTION, page_query({"event_key": ""}, cursor), [("_id", ASCENDING)]),
+        (OBJECTIVE_RAW_COLLECTION, page_query({"team_number": ""}, cursor), [("_id", ASCENDING)]),
+        (OBJECTIVE_RAW_COLLECTION, page_query({"event_key": "", "team_number": ""}, cursor), [("_id", ASCENDING)]),
+        # Outbox
+        (OBJECTIVE_RAW_COLLECTION, get_outbox_query("http://remote:8000"), [("_id", ASCENDING)]),
+        # Feature sync, refresh and count_obj_matches
+        (OBJECTIVE_FEATURE_COLLECTION, {"ulid": {"$in": [""]}}, None),
+        (OBJECTIVE_FEATURE_COLLECTION, {"event_key": "", "team_number": teams}, None),
+        (OBJECTIVE_FEATURE_COLLECTION, {"team_number": "", "event_key": ""}, None),
+        (OBJECTIVE_FEATURE_COLLECTION, {"event_key": ""}, None),
+        (OBJECTIVE_ACCUMULATOR_COLLECTION, {"team_number": "", "event_key": ""}, None),
+        (OBJECTIVE_ACCUMULATOR_COLLECTION, {"event_key": "", "team_number": teams}, None),
+        # Results
+        (OBJECTIVE_RESULT_COLLECTION, {"team_number": "", "event_key": ""}, None),
+        (OBJECTIVE_RESULT_COLLECTION, {"team_number": ""}, [("_id", DESCENDING)]),
+        (OBJECTIVE_RESULT_COLLECTION, {"event_key": ""}, None),
+        (OBJECTIVE_RESULT_COLLECTION, page_query({}, cursor), [("_id", ASCENDING)]),
+        (OBJECTIVE_RESULT_COLLECTION, page_query({"event_key": ""}, cursor), [("_id", ASCENDING)]),
+        # Subjective
+        (SUBJECTIVE_RAW_COLLECTION, {"ulid": ""}, None),
+        (SUBJECTIVE_RAW_COLLECTION, {"match_id": ""}, None),
+        (SUBJECTIVE_RAW_COLLECTION, {"event_key": ""}, None),
+        (SUBJECTIVE_RAW_COLLECTION, page_query({}, cursor), [("_id", ASCENDING)]),
+        (SUBJECTIVE_RESULT_COLLECTION, {"team_number": "", "event_key": ""}, None),
+        (SUBJECTIVE_RESULT_COLLECTION, {"team_number": ""}, [("_id", DESCENDING)]),
+        (SUBJECTIVE_RESULT_COLLECTION, {"event_key": "", "team_number": {"$nin": [""]}}, None),
+        # Pit
+        (PIT_DATA_COLLECTION, {"ulid": ""}, None),
+        (PIT_DATA_COLLECTION, page_query({}, cursor), [("_id", ASCENDING)]),
+        # Job queue
+        (JOB_COLLECTION, {"type": "", "event_key": "", "status": "pending"}, None),
+        (JOB_COLLECTION, get_due_jobs_query(datetime.now(timezone.utc)), [("available_at", ASCENDING)]),
+    ]
+
+
+def find_plan_stages(plan: dict | list):
+    if isinstance(plan, list):
+        return [stage for item in plan for stage in find_plan_stages(item)]
+    if not isinstance(plan, dict):
+        return []
+
+    stages = [plan["stage"]] if "stage" in plan else []
+    for value in plan.values():
+        if isinstance(value, (dict, list)):
+            stages.extend(find_plan_stages(value))
+    return stages
+
+
+async def check_query_plans():
+    """
+    Run every hot query through explain and report the ones that scan a collection,
+    or examine more keys or documents than they return.
+    """
+    report = []
+    for collection, query, sort in get_hot_queries():
+        find = get_collection(collection).find(query)
+        if sort is not None:
+            find = find.sort(sort)
+        # The default verbosity of explain runs the winning plan, so executionStats is included
+        explain = await find.explain()
+        stages = find_plan_stages(explain["queryPlanner"]["winningPlan"])
+        stats = explain["executionStats"]
+        examined = max(stats["totalKeysExamined"], stats["totalDocsExamined"])
+        item = {
+            "collection": collection,
+            "query": list(query.keys()),
+            "sort": sort,
+            "stages": stages,
+            "collscan": "COLLSCAN" in stages,
+            "returned": stats["nReturned"],
+            "keys_examined": stats["totalKeysExamined"],
+            "docs_examined": stats["totalDocsExamined"],
+            "overscan": examined > stats["nReturned"] + PLAN_SLACK
+        }
+        report.append(item)
+        if item["collscan"] or item["overscan"]:
+            print(f"Query {item['query']} on {collection} examines {examined} keys or documents "
+                  f"for {item['returned']} with plan {stages}")
+
+    return report
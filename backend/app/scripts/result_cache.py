@@ -0,0 +1,41 @@
+import os
+from collections import OrderedDict
+
+from ..constants import RESULT_CACHE_SIZE
+
+"""
+[Result cache]
+Serialized ObjectiveResult payloads of this worker, least recently used first.
+Every entry remembers the data generation it was read at, and a lookup with any other generation is a miss,
+so a recompute done by another worker invalidates the entry too.
+"""
+
+# (team_number, event_key) -> (generation, payload)
+result_cache: OrderedDict[tuple[str, str], tuple[int, bytes]] = OrderedDict()
+result_cache_stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+
+def get_cached_result(team_number: str, event_key: str, generation: int):
+    entry = result_cache.get((team_number, event_key))
+    if entry is None or entry[0] != generation:
+        result_cache_stats["misses"] += 1
+        return None
+
+    result_cache.move_to_end((team_number, event_key))
+    result_cache_stats["hits"] += 1
+    return entry[1]
+
+
+def put_cached_result(team_number: str, event_key: str, generation: int, payload: bytes):
+    result_cache[(team_number, event_key)] = (generation, payload)
+    result_cache.move_to_end((team_number, event_key))
+    while len(result_cache) > RESULT_CACHE_SIZE:
+        result_cache.popitem(last=False)
+        result_cache_stats["evictions"] += 1
+
+
+def get_result_cache_stats():
+    """
+    Counters of the cache of this worker only, every uvicorn worker keeps its own cache.
+    """
+    return {**result_cache_stats, "pid": os.getpid(), "size": len(result_cache), "max_size": RESULT_CACHE_SIZE}
@@ -0,0 +1,175 @@
+import asyncio
+import os
+import socket
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+
+from pymongo.errors import DuplicateKeyError
+
+from ..constants import LEASE_COLLECTION, OBJECTIVE_REFRESH_LEASE, SUBJECTIVE_REFRESH_LEASE, REFRESH_DEBOUNCE_SECONDS, \
+    REFRESH_LEASE_SECONDS
+from ..scripts.db import get_collection
+from ..scripts.generation import bump_generation
+from ..scripts.jobs import enqueue_job
+from ..scripts.objective_calculate import post_obj_abs_results, rank_obj_results, refresh_event_obj_results, \
+    count_obj_matches, get_all_events, sync_obj_features
+from ..scripts.subjective_calculate import post_sbj_results, get_all_sbj_events
+
+# Identifies this process (an API or a compute worker) as the owner of a lease and a claimed job
+LEASE_OWNER = f"{socket.gethostname()}-{os.getpid()}"
+
+# Types of the jobs run by app/worker.py
+OBJECTIVE_REFRESH_JOB = "objective_refresh"
+OBJECTIVE_FULL_REFRESH_JOB = "objective_full_refresh"
+SUBJECTIVE_REFRESH_JOB = "subjective_refresh"
+
+
+async def acquire_lease(name: str, ttl: float):
+    """
+    Take (or extend) the lease called name for ttl seconds.
+    Returns False if another worker holds a lease that has not expired yet.
+    """
+    now = datetime.now(timezone.utc)
+    try:
+        await get_collection(LEASE_COLLECTION).update_one(
+            {"_id": name, "$or": [{"expires_at": {"$lt": now}}, {"owner": LEASE_OWNER}]},
+            {"$set": {"owner": LEASE_OWNER, "expires_at": now + timedelta(seconds=ttl)}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        # The lease exists and belongs to someone else, so the upsert tried to insert a second one
+        return False
+
+    return True
+
+
+async def release_lease(name: str):
+    await get_collection(LEASE_COLLECTION).delete_one({"_id": name, "owner": LEASE_OWNER})
+
+
+async def wait_for_lease(name: str, ttl: float):
+    while not await acquire_lease(name, ttl):
+        await asyncio.sleep(REFRESH_DEBOUNCE_SECONDS)
+
+
+async def keep_lease(name: str, ttl: float, holder: asyncio.Task):
+    """
+    Renew the lease every ttl / 3 seconds. When it is taken by another worker, or cannot be renewed before it expires,
+    cancel the holder so that its block stops writing. Returns True in that case.
+    """
+    loop = asyncio.get_running_loop()
+    renewed_at = loop.time()
+    while True:
+        await asyncio.sleep(ttl / 3)
+        try:
+            if await acquire_lease(name, ttl):
+                renewed_at = loop.time()
+                continue
+            print(f"Lost the lease {name}")
+        except Exception as e:
+            print(f"Could not renew the lease {name}: {e}")
+            # Try again while the next attempt is still before the lease expires
+            if loop.time() - renewed_at + ttl / 3 < ttl:
+                continue
+
+        holder.cancel()
+        return True
+
+
+@asynccontextmanager
+async def hold_lease(name: str, ttl: float):
+    """
+    Wait for the lease called name and renew it for as long as the block runs,
+    so that a refresh longer than ttl is not joined by another worker.
+    Raises RuntimeError in the block if the lease is lost, so that a job fails and is retried.
+    """
+    await wait_for_lease(name, ttl)
+    holder = asyncio.current_task()
+    keeper = asyncio.create_task(keep_lease(name, ttl, holder))
+    try:
+        yield
+    except asyncio.CancelledError:
+        if keeper.done() and not keeper.cancelled() and keeper.result():
+            holder.uncancel()
+            raise RuntimeError(f"Lost the lease {name}")
+        raise
+    finally:
+        keeper.cancel()
+        await release_lease(name)
+
+
+async def process_obj_matches(matches: list[dict]):
+    """
+    Everything that follows the insert of new raw records, whether they were posted or pulled from a peer.
+    Only the generation and the job queue are written here, the refresh job turns the records into feature rows.
+    """
+    for event_key in set(match["event_key"] for match in matches):
+        await bump_generation(event_key)
+    await enqueue_obj_matches(matches)
+
+
+async def enqueue_obj_matches(matches: list[dict]):
+    """
+    Queue the refresh of the teams of matches without bumping the generation. The handlers call it for a record
+    that is already here, in case a previous attempt inserted it but failed before queuing its refresh.
+    """
+    for event_key in set(match["event_key"] for match in matches):
+        # Only these teams' absolute results and the ranks change, a record without a team has no result
+        await enqueue_obj_refresh(event_key, [match["team_number"] for match in matches
+                                              if match["event_key"] == event_key and match["team_number"] != ""])
+
+
+async def enqueue_obj_refresh(event_key: str, teams: list[str]):
+    """
+    Queue a refresh of teams of the event. A burst of submissions is coalesced into one job per event.
+    """
+    await enqueue_job(OBJECTIVE_REFRESH_JOB, event_key, teams, delay=REFRESH_DEBOUNCE_SECONDS)
+
+
+async def enqueue_full_obj_refresh(event_key: str = None):
+    await enqueue_job(OBJECTIVE_FULL_REFRESH_JOB, event_key)
+
+
+async def enqueue_sbj_refresh(event_key: str):
+    await enqueue_job(SUBJECTIVE_REFRESH_JOB, event_key, delay=REFRESH_DEBOUNCE_SECONDS)
+
+
+def get_refresh_lease(event_key: str):
+    return f"{OBJECTIVE_REFRESH_LEASE}:{event_key}"
+
+
+async def refresh_obj_teams(event_key: str, teams: set[str]):
+    # Jobs queued before empty team numbers were filtered out may still carry one
+    teams = {team for team in teams if team != ""}
+    await sync_obj_features(event_key, list(teams))
+    counts = await count_obj_matches(event_key, list(teams))
+    for team in teams:
+        await post_obj_abs_results(team, event_key, counts)
+    await rank_obj_results(event_key)
+    # A cached result read at an older generation is a miss from now on, in every API worker
+    await bump_generation(event_key)
+
+
+async def run_obj_refresh(event_key: str, teams: list[str]):
+    # Only one worker in the cluster refreshes the results of an event at a time, other events go on in parallel
+    async with hold_lease(get_refresh_lease(event_key), REFRESH_LEASE_SECONDS):
+        await refresh_obj_teams(event_key, set(teams))
+        print(f"Refreshed {len(teams)} team(s) of event {event_key}")
+
+
+async def run_full_obj_refresh(event_key: str = None):
+    event_keys = await get_all_events() if event_key is None else [event_key]
+    for event_key in event_keys:
+        async with hold_lease(get_refresh_lease(event_key), REFRESH_LEASE_SECONDS):
+            await refresh_event_obj_results(event_key)
+            await bump_generation(event_key)
+
+    return {"message": "Data refreshed successfully"}
+
+
+async def run_sbj_refresh(event_key: str = None):
+    event_keys = await get_all_sbj_events() if event_key is None else [event_key]
+    for event_key in event_keys:
+        # The results of an event are upserted and the stale ones deleted, two workers must not interleave that
+        async with hold_lease(f"{SUBJECTIVE_REFRESH_LEASE}:{event_key}", REFRESH_LEASE_SECONDS):
+            await post_sbj_results(event_key)
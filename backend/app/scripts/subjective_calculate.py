@@ -1,117 +1,116 @@
-from operator import itemgetter
-
-import numba
 import numpy as np
+from pymongo import DeleteMany, UpdateOne
 
 from ..scripts.db import get_collection
+from ..scripts.compute import run_compute
 
 from ..constants import SUBJECTIVE_RAW_COLLECTION, SUBJECTIVE_RESULT_COLLECTION
 
-
-async def get_team_datas(team_number: int, key: str):
-    data = [
-        await get_collection(SUBJECTIVE_RAW_COLLECTION).find(
-            {"team1.team_number": team_number},
-            {
-                "_id": 0,
-                key: "$team1." + key
-            },
-        ),
-        await get_collection(SUBJECTIVE_RAW_COLLECTION).find(
-            {"team2.team_number": team_number},
-            {
-                "_id": 0,
-                key: "$team2." + key
-            },
-        ),
-        await get_collection(SUBJECTIVE_RAW_COLLECTION).find(
-            {"team3.team_number": team_number},
-            {
-                "_id": 0,
-                key: "$team3." + key
-            },
-        ),
-    ]
-    return data
-
-
-@numba.jit(cache=True)
-def analysis_absolute(data: list[dict], key: str):
-    data_np = np.array([])
-    for i in data:
-        data_np = np.append(data_np, i[key])
-
-    average = np.mean(data_np)
-    stability = average / np.std(data_np)
-    return {"average": average, "stability": stability}
-
-
-async def analysis_relative(team_number: int, key: str, is_descending: bool = False):
-    unsorted_data = [
-        await get_collection(SUBJECTIVE_RESULT_COLLECTION).find(
-            {},
-            {
-                "_id": 0,
-                "team_number": 1,
-                key: 1
+# metric -> True if a higher value is better. The rankings given by the super scout are better when lower (1st > 3rd)
+SBJ_METRICS = {
+    "driver_awareness": False,
+    "coral_station_awareness": False,
+    "num_score_on_net": True,
+    "mobility": False,
+    "defense": False,
+}
+
+TEAM_SLOTS = ["team1", "team2", "team3"]
+
+
+async def get_sbj_rows(event_key: str = None):
+    """
+    One row per team per match with every metric as a number, read with a single aggregation.
+    Every record rates three teams, so the three slots are unwound into rows of their own.
+    """
+    pipeline = [] if event_key is None else [{"$match": {"event_key": event_key}}]
+    pipeline.extend([
+        {"$project": {"_id": 0, "team": [f"${slot}" for slot in TEAM_SLOTS]}},
+        {"$unwind": "$team"},
+        {"$match": {"team.team_number": {"$nin": ["", None]}}},
+        {
+            "$project": {
+                "team_number": "$team.team_number",
+                # num_score_on_net is sent as a string, a value that is not a number counts as missing
+                **{
+                    metric: {"$convert": {"input": f"$team.{metric}", "to": "double", "onError": None, "onNull": None}}
+                    for metric in SBJ_METRICS
+                }
             }
-        )
-    ]
-    data = sorted(unsorted_data, key=itemgetter(key),
-                  reverse=is_descending)  # Cus less is better
-    return calc_relative(team_number, data, key)
-
-
-@numba.jit(cache=True)
-def calc_relative(team_number: int, data: list, key: str):
-    rank = 0
-    for i in data:
-        if i["team_number"] == team_number:
-            rank = i[key]
-            break
-
-    data_np = np.array(d[rank-1] for d in data)
-    z_score = (data_np[rank-1] - np.mean(data_np)) / np.std(data_np)
-
-    return {"rank": rank, "z_score": z_score}
-
-
-async def get_driver_awareness(team_number: int):
-    data = await get_team_datas(team_number, "driver_awareness")
-    return analysis_absolute(data) | await analysis_relative(team_number, "driver_awareness", False)
-
-
-async def get_coral_station_awareness(team_number: int):
-    data = await get_team_datas(team_number, "coral_station_awareness")
-    return analysis_absolute(data) | await analysis_relative(team_number, "coral_station_awareness", False)
-
-
-async def get_num_score_on_net(team_number: int):
-    data = await get_team_datas(team_number, "num_score_on_net")
-    return analysis_absolute(data) | await analysis_relative(team_number, "num_score_on_net", True)
-
-
-async def get_mobility(team_number: int):
-    data = await get_team_datas(team_number, "mobility")
-    return analysis_absolute(data) | await analysis_relative(team_number, "mobility", False)
+        },
+    ])
+
+    return await (await get_collection(SUBJECTIVE_RAW_COLLECTION).aggregate(pipeline)).to_list(None)
+
+
+def calc_sbj_results(rows: list[dict]):
+    """
+    Absolute and relative stats of every metric for every team in rows, in one pass over a (rows x metrics) matrix.
+    Returns team_number -> result.
+    """
+    from ..scripts.kernels import rank_descending, z_scores
+
+    if not rows:
+        return {}
+
+    teams, team_index = np.unique([row["team_number"] for row in rows], return_inverse=True)
+    values = np.array([[row.get(metric) for metric in SBJ_METRICS] for row in rows], dtype=np.float64)
+    team_count, metric_count = len(teams), len(SBJ_METRICS)
+
+    # Flat (team, metric) cell of every value, missing values are left out of every sum
+    cells = (team_index[:, None] * metric_count + np.arange(metric_count)).ravel()
+    valid = ~np.isnan(values.ravel())
+    cells, flat_values = cells[valid], values.ravel()[valid]
+
+    counts = np.bincount(cells, minlength=team_count * metric_count)
+    # Without any value bincount returns integers, which the divisions below cannot write into
+    sums = np.bincount(cells, flat_values, minlength=team_count * metric_count).astype(np.float64)
+    averages = np.divide(sums, counts, out=np.zeros_like(sums), where=counts != 0)
+    m2 = np.bincount(cells, (flat_values - averages[cells]) ** 2, minlength=team_count * metric_count).astype(np.float64)
+    std = np.sqrt(np.divide(m2, counts, out=np.zeros_like(m2), where=counts != 0))
+    stability = np.divide(averages, std, out=np.zeros_like(averages), where=std != 0)
+
+    averages = averages.reshape(team_count, metric_count)
+    stability = stability.reshape(team_count, metric_count)
+
+    direction = np.array([1.0 if higher_is_better else -1.0 for higher_is_better in SBJ_METRICS.values()])
+    ranks = rank_descending(averages * direction)
+    scores = z_scores(averages)
+
+    results = {}
+    for i, team_number in enumerate(teams.tolist()):
+        results[team_number] = {
+            "team_number": team_number,
+            **{
+                metric: {
+                    "average": float(averages[i, j]),
+                    "stability": float(stability[i, j]),
+                    "rank": int(ranks[i, j]),
+                    "z_score": float(scores[i, j])
+                }
+                for j, metric in enumerate(SBJ_METRICS)
+            }
+        }
 
+    return results
 
-async def get_defense(team_number: int):
-    data = await get_team_datas(team_number, "defense")
-    return analysis_absolute(data) | await analysis_relative(team_number, "defense", False)
 
+async def post_sbj_results(event_key: str):
+    """
+    Recompute the results of every team of the event, one upserted document per team and event.
+    The absolute stats only change for the rated teams, but their ranks move every other team of the event too.
+    """
+    results = await run_compute(calc_sbj_results, await get_sbj_rows(event_key))
+    requests = [
+        UpdateOne({"team_number": team_number, "event_key": event_key}, {"$set": {**data, "event_key": event_key}}, upsert=True)
+        for team_number, data in results.items()
+    ]
+    # Teams whose last record of the event was deleted
+    requests.append(DeleteMany({"event_key": event_key, "team_number": {"$nin": list(results)}}))
+    await get_collection(SUBJECTIVE_RESULT_COLLECTION).bulk_write(requests, ordered=False)
 
-async def pack_result(team_number: int):
-    return {
-        "team_number": team_number,
-        "driver_awareness": await get_driver_awareness(team_number),
-        "coral_station_awareness": await get_coral_station_awareness(team_number),
-        "num_score_on_net": await get_num_score_on_net(team_number),
-        "mobility": await get_mobility(team_number),
-        "defense": await get_defense(team_number),
-    }
+    return {"message": "Data posted successfully"}
 
 
-async def post_sbj_results(team_number: int):
-    data = await pack_result(team_number)
-    await get_collection(SUBJECTIVE_RESULT_COLLECTION).insert_one(data, bypass_document_validation=False, session=None)
+async def get_all_sbj_events():
+    return await get_collection(SUBJECTIVE_RAW_COLLECTION).distinct("event_key")
@@ -0,0 +1,125 @@
+import asyncio
+from datetime import datetime, timezone
+
+from pymongo.errors import BulkWriteError
+
+from ..constants import REMOTE_SERVERS, SYNC_PEERS, SYNC_LEASE, SYNC_INTERVAL_SECONDS, SYNC_PAGE_SIZE, \
+    SYNC_STATE_COLLECTION, SYNC_OVERLAP_SECONDS, OBJECTIVE_RAW_COLLECTION, SUBJECTIVE_RAW_COLLECTION, PIT_DATA_COLLECTION, \
+    NEXT_CURSOR_HEADER
+from ..scripts.db import get_collection
+from ..scripts.scheduler import acquire_lease, release_lease, process_obj_matches, enqueue_sbj_refresh
+from ..scripts.util import open_remote_session, remote_semaphore, rewind_cursor
+from ..scripts.outbox import OUTBOX_ROUTES, get_pending_remotes
+
+"""
+[Pull sync]
+Pulls the records a peer got since the last pull, page by page through its fetch endpoints.
+The cursor after the last pulled record is the high-water mark of the peer and is kept in sync_state,
+so after a network partition the servers converge in a few bounded pages instead of one request per record.
+The cursor is an _id, made by the driver of the peer's worker from its clock, so a record another worker inserted
+at the same time can commit after a page that already went past it. Every pull therefore starts
+SYNC_OVERLAP_SECONDS before the stored cursor, and the records pulled again are skipped by their ulid.
+"""
+
+# collection -> fetch endpoint of the peer
+SYNC_ROUTES = {
+    OBJECTIVE_RAW_COLLECTION: "/objective/fetch",
+    SUBJECTIVE_RAW_COLLECTION: "/subjective/fetch",
+    PIT_DATA_COLLECTION: "/pit_scout/fetch",
+}
+
+sync_task: asyncio.Task = None
+
+
+async def insert_pulled(collection_name: str, data: list[dict], peer: str):
+    """
+    Insert the records pulled from peer, the ones whose ulid is already here are skipped. Returns the inserted ones.
+    The peer has them already, so the outbox does not send them back when the peer is also a remote.
+    """
+    if not data:
+        return []
+    if collection_name in OUTBOX_ROUTES:
+        uploaded_remote = [peer] if peer in REMOTE_SERVERS else []
+        data = [{**document, "pending_remotes": get_pending_remotes(peer), "uploaded_remote": uploaded_remote}
+                for document in data]
+
+    skipped = set()
+    try:
+        await get_collection(collection_name).insert_many(data, ordered=False)
+    except BulkWriteError as e:
+        for error in e.details["writeErrors"]:
+            skipped.add(error["index"])
+            if error["code"] != 11000:
+                print(f"Failed to insert pulled data {data[error['index']].get('ulid')}: {error['errmsg']}")
+
+    return [document for index, document in enumerate(data) if index not in skipped]
+
+
+async def pull_from_peer(peer: str, collection_name: str, fetch_path: str):
+    state_id = f"{peer}{fetch_path}"
+    state = await get_collection(SYNC_STATE_COLLECTION).find_one({"_id": state_id})
+    cursor = None if state is None else rewind_cursor(state["cursor"], SYNC_OVERLAP_SECONDS)
+    session = await open_remote_session()
+
+    pulled = 0
+    while True:
+        params = {"limit": SYNC_PAGE_SIZE} if cursor is None else {"limit": SYNC_PAGE_SIZE, "cursor": cursor}
+        async with remote_semaphore, session.get(f"{peer}{fetch_path}", params=params) as response:
+            response.raise_for_status()
+            data = await response.json()
+            next_cursor = response.headers.get(NEXT_CURSOR_HEADER)
+
+        inserted = await insert_pulled(collection_name, data, peer)
+        if collection_name == OBJECTIVE_RAW_COLLECTION and inserted:
+            await process_obj_matches(inserted)
+        if collection_name == SUBJECTIVE_RAW_COLLECTION:
+            for event_key in set(document["event_key"] for document in inserted):
+                await enqueue_sbj_refresh(event_key)
+        pulled += len(inserted)
+
+        # A peer that sends no cursor, or the same one again, would hand out the same page forever
+        if next_cursor is None or next_cursor == cursor:
+            break
+        cursor = next_cursor
+        await get_collection(SYNC_STATE_COLLECTION).update_one(
+            {"_id": state_id},
+            {"$set": {"cursor": cursor, "synced_at": datetime.now(timezone.utc)}},
+            upsert=True
+        )
+        if len(data) < SYNC_PAGE_SIZE:
+            break
+
+    if pulled:
+        print(f"Pulled {pulled} data from {peer}{fetch_path}")
+    return pulled
+
+
+async def run_sync():
+    import aiohttp
+
+    while True:
+        try:
+            if await acquire_lease(SYNC_LEASE, SYNC_INTERVAL_SECONDS * 3):
+                for peer in SYNC_PEERS:
+                    for collection_name, fetch_path in SYNC_ROUTES.items():
+                        try:
+                            await pull_from_peer(peer, collection_name, fetch_path)
+                        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                            print(f"Failed to pull from {peer}{fetch_path} with error: {e}")
+        except Exception as e:
+            print(f"Sync failed with error: {e}")
+        await asyncio.sleep(SYNC_INTERVAL_SECONDS)
+
+
+def start_sync():
+    global sync_task
+    if SYNC_PEERS and (sync_task is None or sync_task.done()):
+        sync_task = asyncio.create_task(run_sync())
+
+
+async def stop_sync():
+    global sync_task
+    if sync_task is not None:
+        sync_task.cancel()
+        sync_task = None
+        await release_lease(SYNC_LEASE)
@@ -1,7 +1,15 @@
-from pymongo import AsyncMongoClient
-import aiohttp
+import asyncio
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import timedelta
 
-from ..constants import MONGO_URL, DATABASE_NAME, OBJECTIVE_RAW_COLLECTION
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import HTTPException
+from pymongo import AsyncMongoClient, ASCENDING, DESCENDING
+
+from ..constants import MONGO_URL, DATABASE_NAME, OBJECTIVE_RAW_COLLECTION, REMOTE_LIMIT_PER_HOST, \
+    REMOTE_KEEPALIVE_SECONDS, REMOTE_CONCURRENCY, REMOTE_TIMEOUT_SECONDS
 from ..scripts.db import get_collection
 
 
@@ -20,22 +28,109 @@ async def get_all_teams(event_key: str = None):
     return team_set
 
 
-async def post_to_remote_server(data: dict, ulid: str, remote_server: str, remote_path: str, collection_name: str):
-    remote_url = f"{remote_server}{remote_path}"
+"""
+[Cursor pagination]
+Pages are ordered by _id and a cursor is the _id of the last document of a page, encoded so that clients treat it as opaque.
+_id is made by the driver of each worker from its clock, a random value per process and a counter, so it only roughly
+follows the commit order: a document inserted by another worker at the same time can commit behind a cursor that was
+already handed out. Walking the pages of a snapshot is exact, but a client that pulls new documents repeatedly has to
+resume from a window before its cursor and skip the documents it has by ulid, as the pull sync does (rewind_cursor).
+"""
+
+
+def encode_cursor(object_id: ObjectId):
+    return urlsafe_b64encode(object_id.binary).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(remote_url, json=data) as response:
-                if response.status >= 200 and response.status < 300:
-                    print(f"Data sent to {remote_url} successfully")
-                    await get_collection(collection_name).update_one(
-                        {"ulid": ulid}, {"$push": {"uploaded_remote": remote_server}})
-                elif response.status == 409:
-                    print(f"Data already exists in {remote_url}")
-                    await get_collection(collection_name).update_one(
-                        {"ulid": ulid}, {"$push": {"uploaded_remote": remote_server}})
-                else:
-                    print(f"Failed to send data to {remote_url} with status code {response.status} and response text: {await response.text()}")
-    except aiohttp.ClientConnectorError as e:
-        print(f"Failed to connect to {remote_url} with error: {e}")
-    except Exception as e:
-        print(f"Failed to send data to {remote_url} with error: {e}")
+        return ObjectId(urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (ValueError, TypeError, InvalidId):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def rewind_cursor(cursor: str, seconds: float):
+    """
+    Cursor before every document whose _id was made more than seconds before the one of cursor.
+    """
+    object_id = decode_cursor(cursor)
+    return encode_cursor(ObjectId.from_datetime(object_id.generation_time - timedelta(seconds=seconds)))
+
+
+def page_query(query: dict, cursor: str = None):
+    if cursor is None:
+        return query
+    return {"$and": [query, {"_id": {"$gt": decode_cursor(cursor)}}]}
+
+
+async def find_page(collection_name: str, query: dict, cursor: str = None, limit: int = None):
+    """
+    Returns one page of documents (without _id) after cursor and the cursor after its last document.
+    A page shorter than limit is the last one for now, its cursor is where the next incremental pull resumes
+    after rewinding it (see [Cursor pagination]).
+    """
+    find = get_collection(collection_name).find(page_query(query, cursor)).sort("_id", ASCENDING)
+    if limit is not None:
+        find = find.limit(limit)
+    data = await find.to_list(None)
+
+    next_cursor = encode_cursor(data[-1]["_id"]) if data else cursor
+    for document in data:
+        del document["_id"]
+
+    return data, next_cursor
+
+
+async def find_next_cursor(collection_name: str, query: dict, cursor: str = None, limit: int = None):
+    """
+    Cursor after the last document of the page starting at cursor, read from the _id index only.
+    Lets a streamed page send its continuation before the documents.
+    """
+    last = []
+    if limit is not None:
+        last = await get_collection(collection_name).find(page_query(query, cursor), {"_id": 1}) \
+            .sort("_id", ASCENDING).skip(limit - 1).limit(1).to_list(None)
+    if not last:
+        last = await get_collection(collection_name).find(page_query(query, cursor), {"_id": 1}) \
+            .sort("_id", DESCENDING).limit(1).to_list(None)
+    return encode_cursor(last[0]["_id"]) if last else cursor
+
+
+def wants_ndjson(accept: str = None):
+    return accept is not None and "application/x-ndjson" in accept
+
+
+async def stream_ndjson(cursor):
+    """
+    Write the documents of an async cursor as NDJSON lines as soon as each batch arrives.
+    """
+    async for document in cursor:
+        yield json.dumps(document, default=str) + "\n"
+
+
+remote_session: "aiohttp.ClientSession" = None
+# Caps the replication requests in flight so that flushing a backlog does not starve the event loop
+remote_semaphore = asyncio.Semaphore(REMOTE_CONCURRENCY)
+
+
+async def open_remote_session():
+    """
+    Create the session every replication request of this worker goes through, so connections to a remote are reused.
+    """
+    global remote_session
+    # aiohttp is only imported by the workers that replicate or sync
+    import aiohttp
+
+    if remote_session is None or remote_session.closed:
+        remote_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit_per_host=REMOTE_LIMIT_PER_HOST, keepalive_timeout=REMOTE_KEEPALIVE_SECONDS),
+            timeout=aiohttp.ClientTimeout(total=REMOTE_TIMEOUT_SECONDS)
+        )
+    return remote_session
+
+
+async def close_remote_session():
+    global remote_session
+    if remote_session is not None:
+        await remote_session.close()
+        remote_session = None
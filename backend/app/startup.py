@@ -0,0 +1,58 @@
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+
+from .constants import PROFILE_STARTUP
+
+"""
+[Startup profile]
+With PROFILE_STARTUP=1 every worker prints how long its imports and init steps took once it is ready to serve.
+`python -m app.startup --profile-startup` also breaks the import of app.main down per module with -X importtime,
+and exits without serving, so a slow new import shows up before it reaches the venue.
+"""
+
+# (step, seconds) in the order they finished
+startup_steps: list[tuple[str, float]] = []
+
+
+@contextmanager
+def startup_step(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        startup_steps.append((name, time.perf_counter() - start))
+
+
+def print_startup_profile():
+    if not PROFILE_STARTUP:
+        return
+
+    print("Startup profile:")
+    for name, seconds in startup_steps:
+        print(f"  {name:<36}{seconds * 1000:9.1f} ms")
+    print(f"  {'total':<36}{sum(seconds for _, seconds in startup_steps) * 1000:9.1f} ms")
+
+
+def profile_imports(module: str = "app.main", top: int = 25):
+    """
+    Cumulative import time of the slowest modules imported by module, measured in a fresh interpreter.
+    """
+    output = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True).stderr
+    imports = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        imports.append((name.strip(), int(cumulative) / 1000))
+
+    return sorted(imports, key=lambda item: item[1], reverse=True)[:top]
+
+
+if __name__ == "__main__":
+    if "--profile-startup" in sys.argv:
+        print("Slowest imports of app.main (cumulative):")
+        for name, milliseconds in profile_imports():
+            print(f"  {name:<36}{milliseconds:9.1f} ms")
@@ -0,0 +1,55 @@
+import asyncio
+import signal
+
+from .constants import REMOTE_SERVERS, SYNC_PEERS
+from .scripts.db import init_db, disconnect_from_mongo
+from .scripts.compute import start_compute_pool, stop_compute_pool
+from .scripts.jobs import run_jobs
+from .scripts.scheduler import LEASE_OWNER, OBJECTIVE_REFRESH_JOB, OBJECTIVE_FULL_REFRESH_JOB, SUBJECTIVE_REFRESH_JOB, \
+    run_obj_refresh, run_full_obj_refresh, run_sbj_refresh, enqueue_full_obj_refresh
+from .scripts.util import open_remote_session, close_remote_session
+from .scripts.outbox import start_outbox, stop_outbox
+from .scripts.sync import start_sync, stop_sync
+
+"""
+[Compute worker]
+Runs the jobs queued by the API workers, the replication outbox and the pull sync, started with python -m app.worker.
+It shares nothing with the API workers but the database, so both can be scaled on their own.
+"""
+
+
+# job type -> handler of the job
+JOB_HANDLERS = {
+    OBJECTIVE_REFRESH_JOB: lambda job: run_obj_refresh(job["event_key"], job["teams"]),
+    OBJECTIVE_FULL_REFRESH_JOB: lambda job: run_full_obj_refresh(job["event_key"]),
+    SUBJECTIVE_REFRESH_JOB: lambda job: run_sbj_refresh(job["event_key"]),
+}
+
+
+async def main():
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        asyncio.get_running_loop().add_signal_handler(sig, stop.set)
+
+    start_compute_pool()
+    if await init_db():
+        await enqueue_full_obj_refresh()
+    if REMOTE_SERVERS or SYNC_PEERS:
+        await open_remote_session()
+    start_outbox()
+    start_sync()
+    print(f"Worker {LEASE_OWNER} started")
+
+    try:
+        await run_jobs(LEASE_OWNER, JOB_HANDLERS, stop)
+    finally:
+        await stop_sync()
+        await stop_outbox()
+        await close_remote_session()
+        stop_compute_pool()
+        await disconnect_from_mongo()
+        print(f"Worker {LEASE_OWNER} stopped")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
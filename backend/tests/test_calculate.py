@@ -0,0 +1,207 @@
+import unittest
+
+import numpy as np
+
+from app.scripts.objective_calculate import MATCH_METRICS, REL_METRICS, calc_match_abs, calc_match_cycles, \
+    calc_obj_ranks
+from app.scripts.subjective_calculate import SBJ_METRICS, calc_sbj_results
+
+"""
+[Calculations]
+The pure stages of a refresh on hand-made matches and results, no mongod needed.
+"""
+
+
+def make_match(auto_path: list[dict] = None, teleop_path: list[dict] = None, **fields):
+    match = {
+        "ulid": "01JTEST0000000000000000000",
+        "team_number": "6998",
+        "event_key": "2025test",
+        "auto": {"preload": "coral", "start_position": "left", "leave": True, "path": auto_path or []},
+        "teleop": {"path": teleop_path or [], "hang_time": 4.5},
+        "bypassed": False,
+        "disabled": False,
+    }
+    match.update(fields)
+    return match
+
+
+def make_result(averages: dict):
+    """
+    A result holding only the given metric averages, in the nested shape of ObjectiveResult.
+    """
+    result = {}
+    for metric, average in averages.items():
+        *parents, key = metric.split(".")
+        item = result
+        for parent in parents:
+            item = item.setdefault(parent, {})
+        item[key] = {"average": average}
+    return result
+
+
+class MatchAbsTest(unittest.TestCase):
+    def test_every_metric_is_counted(self):
+        metrics = calc_match_abs(make_match(
+            auto_path=[
+                {"point": "l4ReefAB", "success": True},
+                {"point": "l4ReefAB", "success": False},
+                {"point": "l1ReefCD", "success": True},
+                {"point": "processor", "success": True},
+                {"point": "net", "success": False},
+                {"point": "leftCoralStation", "success": True},
+            ],
+            teleop_path=[
+                {"point": "coralStation", "timestamp": 1},
+                {"point": "l2Reef", "timestamp": 4},
+                {"point": "l4Reef", "timestamp": 9},
+                {"point": "processor", "timestamp": 14},
+                {"point": "net", "timestamp": 15},
+            ],
+            disabled=True
+        ))
+
+        self.assertEqual(set(metrics), set(MATCH_METRICS))
+        expected = {
+            "auto.preload.coral": 1,
+            "auto.preload.none": 0,
+            "auto.start_position.left": 1,
+            "auto.start_position.right": 0,
+            "auto.leave": 1,
+            # Attempts count towards the levels and the scores, successes towards the reef points
+            "auto.reef.l4": 2,
+            "auto.reef.l1": 1,
+            "auto.reef.l2": 0,
+            "auto.reef_point.l4.AB": 1,
+            "auto.reef_point.l1.CD": 1,
+            "auto.reef_point.l4.CD": 0,
+            "auto.reef_attempt_by_side.AB": 2,
+            "auto.reef_success_by_side.AB": 1,
+            "auto.reef_success_by_side.CD": 1,
+            "auto.reef_score_by_side.AB": 14,
+            "auto.reef_score_by_side.CD": 3,
+            "auto.reef_score": 17,
+            "auto.processor_score": 6,
+            "auto.net_score": 0,
+            "teleop.reef.l1": 0,
+            "teleop.reef.l2": 1,
+            "teleop.reef.l4": 1,
+            "teleop.processor_score": 6,
+            "teleop.net_score": 4,
+            "teleop.hang": 4.5,
+            "bypassed": 0,
+            "disabled": 1,
+        }
+        self.assertEqual({metric: metrics[metric] for metric in expected}, expected)
+
+    def test_empty_match_counts_nothing(self):
+        metrics = calc_match_abs(make_match(auto={"path": []}, teleop={"path": []}))
+
+        self.assertTrue(all(value == 0 for value in metrics.values()))
+
+    def test_unknown_points_are_ignored(self):
+        metrics = calc_match_abs(make_match(auto_path=[{"point": "nowhere", "success": True}],
+                                            teleop_path=[{"point": "nowhere", "timestamp": 1}]))
+
+        self.assertEqual(metrics["auto.reef_score"], 0)
+        self.assertEqual(metrics["teleop.net_score"], 0)
+
+
+class MatchCyclesTest(unittest.TestCase):
+    def test_a_cycle_starts_at_the_first_pickup_after_the_previous_score(self):
+        cycles = calc_match_cycles({"path": [
+            {"point": "coralStation", "timestamp": 1},
+            {"point": "l2Reef", "timestamp": 4},
+            {"point": "groundCoral", "timestamp": 5},
+            {"point": "groundCoral", "timestamp": 6},
+            {"point": "l4Reef", "timestamp": 9},
+            # No pickup since the last score
+            {"point": "l1Reef", "timestamp": 10},
+            {"point": "groundAlgae", "timestamp": 11},
+            {"point": "reefAlgae", "timestamp": 12},
+            {"point": "processor", "timestamp": 14},
+            {"point": "net", "timestamp": 15},
+        ]})
+
+        self.assertEqual(cycles, {"coral": [3.0, 4.0], "algae": [3.0]})
+
+    def test_points_are_paired_in_time_order(self):
+        cycles = calc_match_cycles({"path": [
+            {"point": "l1Reef", "timestamp": 7},
+            {"point": "net", "timestamp": 20},
+            {"point": "coralStation", "timestamp": 2},
+            {"point": "groundAlgae", "timestamp": 12},
+        ]})
+
+        self.assertEqual(cycles, {"coral": [5.0], "algae": [8.0]})
+
+    def test_a_path_without_scores_has_no_cycles(self):
+        cycles = calc_match_cycles({"path": [{"point": "coralStation", "timestamp": 1}]})
+
+        self.assertEqual(cycles, {"coral": [], "algae": []})
+
+
+class ObjRanksTest(unittest.TestCase):
+    def test_ranks_and_z_scores(self):
+        ranks = calc_obj_ranks([
+            make_result({"auto.reef_score": 10}),
+            make_result({"auto.reef_score": 20}),
+            make_result({"auto.reef_score": 20}),
+        ])
+
+        self.assertEqual(len(ranks), 3)
+        self.assertEqual(set(ranks[0]), {f"{metric}.{leaf}" for metric in REL_METRICS for leaf in ("rank", "z_score")})
+        # Ties keep the order of the results
+        self.assertEqual([item["auto.reef_score.rank"] for item in ranks], [3, 1, 2])
+        np.testing.assert_allclose([item["auto.reef_score.z_score"] for item in ranks],
+                                   [-np.sqrt(2), np.sqrt(2) / 2, np.sqrt(2) / 2])
+
+    def test_missing_metrics_rank_as_zero(self):
+        ranks = calc_obj_ranks([
+            make_result({"teleop.net_score": -1}),
+            make_result({}),
+        ])
+
+        self.assertEqual([item["teleop.net_score.rank"] for item in ranks], [2, 1])
+        # A metric nobody has has no spread
+        self.assertEqual([item["teleop.hang.z_score"] for item in ranks], [0.0, 0.0])
+        self.assertEqual([item["teleop.hang.rank"] for item in ranks], [1, 2])
+
+
+class SbjResultsTest(unittest.TestCase):
+    def test_stats_per_team(self):
+        results = calc_sbj_results([
+            {"team_number": "1", "driver_awareness": 1, "num_score_on_net": 5},
+            {"team_number": "2", "driver_awareness": 2, "num_score_on_net": 0},
+            {"team_number": "3", "driver_awareness": None, "num_score_on_net": None},
+            {"team_number": "1", "driver_awareness": 3, "num_score_on_net": 3},
+            {"team_number": "2", "driver_awareness": 2, "num_score_on_net": 0},
+            {"team_number": "3", "driver_awareness": 1, "num_score_on_net": 2},
+        ])
+
+        self.assertEqual(set(results), {"1", "2", "3"})
+        self.assertEqual(set(results["1"]), {"team_number", *SBJ_METRICS})
+        # Missing values are left out of the average
+        self.assertEqual([results[team]["driver_awareness"]["average"] for team in "123"], [2.0, 2.0, 1.0])
+        # Stability is the average over the standard deviation, 0 without any spread
+        self.assertEqual(results["1"]["driver_awareness"]["stability"], 2.0)
+        self.assertEqual(results["2"]["driver_awareness"]["stability"], 0.0)
+        # A lower ranking given by the super scout is better, ties keep the team order
+        self.assertEqual([results[team]["driver_awareness"]["rank"] for team in "123"], [2, 3, 1])
+        # More scores on the net are better
+        self.assertEqual([results[team]["num_score_on_net"]["rank"] for team in "123"], [1, 3, 2])
+        np.testing.assert_allclose([results[team]["num_score_on_net"]["z_score"] for team in "123"],
+                                   [(4 - 2) / np.sqrt(8 / 3), -2 / np.sqrt(8 / 3), 0], atol=1e-12)
+
+    def test_a_metric_nobody_rated(self):
+        results = calc_sbj_results([{"team_number": "1"}, {"team_number": "2"}])
+
+        self.assertEqual(results["1"]["mobility"], {"average": 0.0, "stability": 0.0, "rank": 1, "z_score": 0.0})
+        self.assertEqual(results["2"]["mobility"]["rank"], 2)
+
+    def test_no_rows(self):
+        self.assertEqual(calc_sbj_results([]), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
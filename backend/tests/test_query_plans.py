@@ -0,0 +1,78 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+
+from pymongo import AsyncMongoClient
+from pymongo.errors import ConnectionFailure
+
+from app.constants import MONGO_URL, DATABASE_NAME
+from app.scripts import db
+from app.scripts.query_plans import check_query_plans, get_hot_queries
+
+"""
+[Query plans]
+Runs every hot query through explain() against the mongod at MONGO_URL, with the indexes of INDEXES
+and SEED_SIZE documents in every collection, and fails if a plan scans a whole collection
+or examines more than it returns. Skipped when no mongod is reachable.
+"""
+
+TEST_DATABASE_NAME = f"{DATABASE_NAME}-test"
+SEED_SIZE = 200
+
+
+def make_seed_document(index: int):
+    """
+    One document with every field a hot query filters on, none of them equal to the sample values of the queries.
+    Every (team_number, event_key) is different, and no job is pending, so the unique indexes hold.
+    """
+    return {
+        "ulid": f"SEED{index:06d}",
+        "match_id": f"match-{index}",
+        "team_number": str(index),
+        "event_key": f"event-{index % 5}",
+        "pending_remotes": [],
+        "type": "seed",
+        "status": "failed",
+        "available_at": datetime.now(timezone.utc) + timedelta(days=1)
+    }
+
+
+class QueryPlanTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.client = AsyncMongoClient(MONGO_URL, serverSelectionTimeoutMS=2000)
+        try:
+            await self.client.admin.command("ping")
+        except ConnectionFailure:
+            await self.client.close()
+            self.skipTest(f"No mongod reachable at {MONGO_URL}")
+
+        await self.client.drop_database(TEST_DATABASE_NAME)
+        db.db = self.client[TEST_DATABASE_NAME]
+        await db.check_collection_exist()
+        await db.ckeck_and_create_index()
+        for collection in db.INDEXES:
+            await db.db[collection].insert_many([make_seed_document(index) for index in range(SEED_SIZE)])
+
+    async def asyncTearDown(self):
+        await self.client.drop_database(TEST_DATABASE_NAME)
+        await self.client.close()
+        db.db = None
+
+    async def test_every_hot_query_is_explained(self):
+        report = await check_query_plans()
+        self.assertEqual(len(report), len(get_hot_queries()))
+
+    async def test_no_hot_query_scans_a_collection(self):
+        for item in await check_query_plans():
+            with self.subTest(collection=item["collection"], query=item["query"], sort=item["sort"]):
+                self.assertFalse(item["collscan"], f"winning plan stages: {item['stages']}")
+
+    async def test_no_hot_query_examines_more_than_it_returns(self):
+        for item in await check_query_plans():
+            with self.subTest(collection=item["collection"], query=item["query"], sort=item["sort"]):
+                self.assertFalse(item["overscan"],
+                                 f"{item['keys_examined']} keys and {item['docs_examined']} documents examined "
+                                 f"for {item['returned']} returned, plan stages: {item['stages']}")
+
+
+if __name__ == "__main__":
+    unittest.main()